@@ -0,0 +1,454 @@
+""" Benchmarks for the smartcab simulation.
+
+Run from the project directory (the one containing this file), e.g.
+
+    python benchmarks.py sense
+    python benchmarks.py waypoints --check-only
+    python benchmarks.py startup --sizes 8x6 200x200
+    python benchmarks.py lights
+    python benchmarks.py dummies --dummies 1000 40000
+    python benchmarks.py suite --baseline logs/baseline.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+from smartcab.environment import Environment
+from smartcab.vectorized import VectorizedEnvironment
+from smartcab.agent import LearningAgent
+from smartcab.planner import compute_waypoint
+from smartcab.simulator import Simulator
+
+
+# Fixed-seed headless scenarios of the benchmark suite
+scenarios = [
+    {'name': 'default-learning', 'grid_size': (8, 6), 'num_dummies': 100, 'learning': True, 'tolerance': 0.05, 'n_test': 10},
+    {'name': 'default-no-learning', 'grid_size': (8, 6), 'num_dummies': 100, 'learning': False, 'tolerance': 0.05, 'n_test': 10},
+    {'name': 'large-no-learning', 'grid_size': (30, 30), 'num_dummies': 2000, 'learning': False, 'tolerance': 0.05, 'n_test': 0},
+    {'name': 'large-vectorized', 'grid_size': (30, 30), 'num_dummies': 2000, 'learning': False, 'tolerance': 0.05, 'n_test': 0,
+     'environment': 'vectorized'}
+]
+environments = {'default': Environment, 'vectorized': VectorizedEnvironment}
+
+
+def build_environment(num_dummies, grid_size, seed=0, environment=Environment, **kwargs):
+    """ Create a quiet environment with a learning primary agent, ready to step. """
+
+    env = environment(num_dummies=num_dummies, grid_size=grid_size, seed=seed, **kwargs)
+    env.quiet = True
+    agent = env.create_agent(LearningAgent, learning=True)
+    env.set_primary_agent(agent, enforce_deadline=True)
+    env.reset()
+    return env
+
+
+def time_steps(env, steps):
+    """ Returns the mean wall time of a step over 'steps' steps, in seconds. """
+
+    elapsed = 0.0
+    for _ in xrange(steps):
+        if env.done:
+            env.reset()
+        start = time.time()
+        env.step()
+        elapsed += time.time() - start
+    return elapsed / steps
+
+
+def bench_sense(args):
+    """ Compare step latency of the spatial index against a full scan in Environment.sense. """
+
+    grid_size = tuple(args.grid_size)
+    print "Step latency on a {}x{} grid ({} steps each)".format(grid_size[0], grid_size[1], args.steps)
+    print "{:>8} {:>14} {:>14} {:>9}".format("dummies", "scan (ms)", "index (ms)", "speedup")
+    for num_dummies in args.dummies:
+        scan = time_steps(build_environment(num_dummies, grid_size, spatial_index=False), args.steps)
+        index = time_steps(build_environment(num_dummies, grid_size, spatial_index=True), args.steps)
+        print "{:>8} {:>14.2f} {:>14.2f} {:>8.1f}x".format(num_dummies, scan * 1000, index * 1000, scan / index)
+
+
+class ReferencePlanner(object):
+    """ RoutePlanner as it was before its waypoints were precomputed. next_waypoint is kept
+        verbatim as the reference that the waypoint table is checked against. """
+
+    def __init__(self, env, agent, destination):
+        self.env = env
+        self.agent = agent
+        self.destination = destination
+
+    def next_waypoint(self):
+        """ Creates the next waypoint based on current heading, location,
+            intended destination and L1 distance from destination. """
+
+        # Collect global location details
+        bounds = self.env.grid_size
+        location = self.env.agent_states[self.agent]['location']
+        heading = self.env.agent_states[self.agent]['heading']
+
+        delta_a = (self.destination[0] - location[0], self.destination[1] - location[1])
+        delta_b = (bounds[0] + delta_a[0] if delta_a[0] <= 0 else delta_a[0] - bounds[0], \
+                   bounds[1] + delta_a[1] if delta_a[1] <= 0 else delta_a[1] - bounds[1])
+
+        # Calculate true difference in location based on world-wrap
+        # This will pre-determine the need for U-turns from improper headings
+        dx = delta_a[0] if abs(delta_a[0]) < abs(delta_b[0]) else delta_b[0]
+        dy = delta_a[1] if abs(delta_a[1]) < abs(delta_b[1]) else delta_b[1]
+
+        # First check if destination is at location
+        if dx == 0 and dy == 0:
+            return None
+        
+        # Next check if destination is cardinally East or West of location    
+        elif dx != 0:
+
+            if dx * heading[0] > 0:  # Heading the correct East or West direction
+                return 'forward'
+            elif dx * heading[0] < 0 and heading[0] < 0: # Heading West, destination East
+                if dy > 0: # Destination also to the South
+                    return 'left'
+                else:
+                    return 'right'
+            elif dx * heading[0] < 0 and heading[0] > 0: # Heading East, destination West
+                if dy < 0: # Destination also to the North
+                    return 'left'
+                else:
+                    return 'right'
+            elif dx * heading[1] > 0: # Heading North destination West; Heading South destination East
+                return 'left'
+            else:
+                return 'right'
+
+        # Finally, check if destination is cardinally North or South of location
+        elif dy != 0:
+
+            if dy * heading[1] > 0:  # Heading the correct North or South direction
+                return 'forward'
+            elif dy * heading[1] < 0 and heading[1] < 0: # Heading North, destination South
+                if dx < 0: # Destination also to the West
+                    return 'left'
+                else:
+                    return 'right'
+            elif dy * heading[1] < 0 and heading[1] > 0: # Heading South, destination North
+                if dx > 0: # Destination also to the East
+                    return 'left'
+                else:
+                    return 'right'
+            elif dy * heading[0] > 0: # Heading West destination North; Heading East destination South
+                return 'right'
+            else:
+                return 'left'
+
+
+def bench_waypoints(args):
+    """ Check RoutePlanner's waypoint table against the original RoutePlanner.next_waypoint
+        over the whole grid, exiting with an error on any mismatch, then time both. """
+
+    grid_size = tuple(args.grid_size)
+    env = build_environment(0, grid_size)
+    planner = env.primary_agent.planner
+    reference = ReferencePlanner(env, env.primary_agent, None)
+    state = env.agent_states[env.primary_agent]
+
+    mismatches = 0
+    cases = []
+    for location in env.intersections:
+        for destination in env.intersections:
+            for heading in env.valid_headings:
+                planner.route_to(destination)
+                reference.destination = destination
+                state['location'] = location
+                state['heading'] = heading
+                expected = reference.next_waypoint()
+                if planner.next_waypoint() != expected or compute_waypoint(location, heading, destination, grid_size) != expected:
+                    mismatches += 1
+                cases.append((location, heading, destination))
+    print "{} of {} (location, heading, destination) cases differ on a {}x{} grid".format(mismatches, len(cases), grid_size[0], grid_size[1])
+    if mismatches:
+        sys.exit(1)
+    if args.check_only:
+        return
+
+    # Time each call from the planner's point of view: read the agent state, then compute or look up
+    computed = 0.0
+    looked_up = 0.0
+    for location, heading, destination in cases:
+        planner.route_to(destination)
+        reference.destination = destination
+        state['location'] = location
+        state['heading'] = heading
+
+        start = time.time()
+        for _ in xrange(args.repeat):
+            reference.next_waypoint()
+        computed += time.time() - start
+
+        start = time.time()
+        for _ in xrange(args.repeat):
+            planner.next_waypoint()
+        looked_up += time.time() - start
+    computed /= len(cases) * args.repeat
+    looked_up /= len(cases) * args.repeat
+
+    print "original next_waypoint: {:.3f} us/call, table lookup: {:.3f} us/call".format(computed * 1e6, looked_up * 1e6)
+
+
+def quadratic_roads(env):
+    """ Returns the roads between neighbouring intersections as Environment.__init__ used to
+        build them, by comparing every pair of intersections. """
+
+    roads = []
+    for a in env.intersections:
+        for b in env.intersections:
+            if a == b:
+                continue
+            if (abs(a[0] - b[0]) + abs(a[1] - b[1])) == 1:  # L1 distance = 1
+                roads.append((a, b))
+    return roads
+
+
+def bench_startup(args):
+    """ Time Environment construction across grid sizes, and check its roads against a pairwise comparison. """
+
+    print "Environment construction ({} dummies, best of {})".format(args.dummies, args.repeat)
+    print "{:>10} {:>14} {:>10} {:>14} {:>16} {:>14}".format("grid", "intersections", "roads", "startup (ms)",
+                                                             "road_arrays (ms)", "pairwise (ms)")
+    mismatches = 0
+    for size in args.sizes:
+        grid_size = tuple(int(n) for n in size.split('x'))
+        startup = arrays = float('inf')
+        for _ in xrange(args.repeat):
+            start = time.time()
+            env = Environment(num_dummies=args.dummies, grid_size=grid_size, seed=0)
+            startup = min(startup, time.time() - start)
+            start = time.time()
+            env.road_arrays()
+            arrays = min(arrays, time.time() - start)
+
+        # The pairwise comparison is quadratic in the number of intersections, so only small grids are checked
+        pairwise = "-"
+        if len(env.intersections) <= args.max_pairwise:
+            start = time.time()
+            roads = quadratic_roads(env)
+            pairwise = "{:.2f}".format((time.time() - start) * 1000)
+            sources, targets = env.road_arrays()
+            if roads != env.roads[:len(roads)] or roads != [(env.intersection_list[a], env.intersection_list[b]) for a, b in zip(sources, targets)]:
+                mismatches += 1
+                pairwise += " MISMATCH"
+        print "{:>10} {:>14} {:>10} {:>14.2f} {:>16.2f} {:>14}".format(size, len(env.intersections), len(env.roads),
+                                                                      startup * 1000, arrays * 1000, pairwise)
+    if mismatches:
+        sys.exit(1)
+
+
+def bench_lights(args):
+    """ Time the light scheduler against updating every TrafficLight on every step, and check they agree. """
+
+    print "Traffic light updates over {} steps".format(args.steps)
+    print "{:>10} {:>14} {:>16} {:>18} {:>9}".format("grid", "intersections", "polling (us)", "scheduler (us)", "speedup")
+    mismatches = 0
+    for size in args.sizes:
+        grid_size = tuple(int(n) for n in size.split('x'))
+        polled = Environment(num_dummies=0, grid_size=grid_size, seed=0)
+        scheduled = Environment(num_dummies=0, grid_size=grid_size, seed=0)
+        lights = polled.intersections.values()
+        polled.lights.reset()
+        scheduled.lights.reset()
+
+        polling = 0.0
+        for t in xrange(args.steps):
+            start = time.time()
+            for traffic_light in lights:
+                traffic_light.update(t)
+            polling += time.time() - start
+
+        scheduler = 0.0
+        for t in xrange(args.steps):
+            start = time.time()
+            scheduled.lights.update(t)
+            scheduler += time.time() - start
+
+        agree = [light.state for light in lights] == [light.state for light in scheduled.intersections.itervalues()] and \
+            scheduled.lights.states == bytearray(light.state for light in lights)
+        mismatches += not agree
+        print "{:>10} {:>14} {:>16.2f} {:>18.2f} {:>8.1f}x{}".format(size, len(lights), polling * 1e6 / args.steps,
+                                                                    scheduler * 1e6 / args.steps, polling / max(scheduler, 1e-9),
+                                                                    "" if agree else "  MISMATCH")
+    if mismatches:
+        sys.exit(1)
+
+
+def bench_dummies(args):
+    """ Time Environment.reset and a step as the number of dummy agents grows on a fixed grid. """
+
+    grid_size = tuple(args.grid_size)
+    environment = environments[args.environment]
+    print "{} on a {}x{} grid, lane capacity {} (best of {})".format(environment.__name__, grid_size[0], grid_size[1],
+                                                                   args.lane_capacity, args.repeat)
+    print "{:>8} {:>12} {:>16} {:>12}".format("dummies", "reset (ms)", "per dummy (us)", "step (ms)")
+    for num_dummies in args.dummies:
+        env = build_environment(num_dummies, grid_size, environment=environment, lane_capacity=args.lane_capacity)
+        reset = float('inf')
+        for _ in xrange(args.repeat):
+            start = time.time()
+            env.reset()
+            reset = min(reset, time.time() - start)
+        step = time_steps(env, args.steps)
+        print "{:>8} {:>12.2f} {:>16.2f} {:>12.2f}".format(num_dummies, reset * 1000, reset * 1e6 / max(num_dummies, 1), step * 1000)
+
+
+def run_scenario(job):
+    """ Runs one scenario through Simulator.run and returns its throughput, memory and Q-table size.
+
+        'job' is a (scenario, seed, profile) tuple. Called in a fresh worker process,
+        so the peak memory reported is that of this scenario alone. """
+
+    scenario, seed, profile = job
+    environment = environments[scenario.get('environment', 'default')]
+    env = environment(num_dummies=scenario['num_dummies'], grid_size=scenario['grid_size'], seed=seed)
+    agent = env.create_agent(LearningAgent, learning=scenario['learning'], alpha=0.5)
+    env.set_primary_agent(agent, enforce_deadline=True)
+
+    sim = Simulator(env, fast_forward=True, profile=profile)
+    sim.run(tolerance=scenario['tolerance'], n_test=scenario['n_test'])
+
+    result = dict(scenario, seed=seed, environment=environment.__name__)
+    result.update({
+        'trials': sim.trials_run,
+        'steps': sim.steps_run,
+        'seconds': sim.run_time,
+        'trials_per_sec': sim.trials_run / max(sim.run_time, 1e-9),
+        'steps_per_sec': sim.steps_run / max(sim.run_time, 1e-9),
+        'peak_memory_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'q_states': len(agent.Q),
+        'q_entries': sum(len(agent.Q[state]) for state in agent.Q)
+    })
+    if profile:
+        result['phases'] = dict((name, {'calls': calls, 'seconds': seconds})
+                                for name, (calls, seconds) in sim.profiler.totals.iteritems())
+    return result
+
+
+def git_revision():
+    """ Returns the commit of the working tree, or 'unknown' outside of a git checkout. """
+
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def bench_suite(args):
+    """ Run the benchmark scenarios, save the results as JSON and compare them against a baseline. """
+
+    selected = [scenario for scenario in scenarios if not args.scenarios or scenario['name'] in args.scenarios]
+    results = []
+    for scenario in selected:
+        # One process per scenario, so peak memory is not carried over between scenarios
+        pool = multiprocessing.Pool(1)
+        try:
+            result = pool.apply(run_scenario, ((scenario, args.seed, args.profile),))
+        finally:
+            pool.close()
+            pool.join()
+        results.append(result)
+        print "{:<20} {:>6} trials {:>7} steps {:>9.1f} steps/sec {:>9.2f} trials/sec {:>9} KB peak {:>5} Q states".format(
+            result['name'], result['trials'], result['steps'], result['steps_per_sec'], result['trials_per_sec'],
+            result['peak_memory_kb'], result['q_states'])
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'profile': args.profile,
+        'results': results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print "Results saved to {}".format(args.output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            report = json.load(f)
+        baseline = dict((result['name'], result) for result in report['results'])
+
+        # Profiling slows every step down, so only compare runs made with the same --profile setting
+        profiled = report.get('profile', any('phases' in result for result in report['results']))
+        if profiled != args.profile:
+            print "Not comparing against {}: it was run {} --profile, and this run {}.".format(
+                args.baseline, "with" if profiled else "without", "was" if args.profile else "was not")
+            sys.exit(2)
+        regressions = 0
+        for result in results:
+            if result['name'] not in baseline:
+                continue
+            ratio = result['steps_per_sec'] / max(baseline[result['name']]['steps_per_sec'], 1e-9)
+            regressed = ratio < 1 - args.threshold
+            regressions += regressed
+            print "{:<20} {:>6.2f}x baseline steps/sec{}".format(result['name'], ratio, "  REGRESSION" if regressed else "")
+        if regressions:
+            sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the smartcab simulation.")
+    subparsers = parser.add_subparsers()
+
+    sense = subparsers.add_parser('sense', help="step latency of the spatial index against a full scan")
+    sense.add_argument('--dummies', type=int, nargs='+', default=[100, 1000, 5000])
+    sense.add_argument('--grid-size', type=int, nargs=2, default=[40, 40])
+    sense.add_argument('--steps', type=int, default=5)
+    sense.set_defaults(func=bench_sense)
+
+    waypoints = subparsers.add_parser('waypoints', help="check and time the precomputed waypoint table")
+    waypoints.add_argument('--grid-size', type=int, nargs=2, default=[8, 6])
+    waypoints.add_argument('--repeat', type=int, default=20)
+    waypoints.add_argument('--check-only', action='store_true', help="only check the table, exiting with an error on any mismatch")
+    waypoints.set_defaults(func=bench_waypoints)
+
+    startup = subparsers.add_parser('startup', help="time Environment construction across grid sizes")
+    startup.add_argument('--sizes', nargs='+', default=['8x6', '50x50', '100x100', '200x200'], help="grid sizes, as COLUMNSxROWS")
+    startup.add_argument('--dummies', type=int, default=100)
+    startup.add_argument('--repeat', type=int, default=3)
+    startup.add_argument('--max-pairwise', type=int, default=2500,
+                         help="largest number of intersections to check against the pairwise construction")
+    startup.set_defaults(func=bench_startup)
+
+    lights = subparsers.add_parser('lights', help="time the traffic light scheduler against polling every light")
+    lights.add_argument('--sizes', nargs='+', default=['8x6', '50x50', '200x200'], help="grid sizes, as COLUMNSxROWS")
+    lights.add_argument('--steps', type=int, default=200)
+    lights.set_defaults(func=bench_lights)
+
+    dummies = subparsers.add_parser('dummies', help="reset and step time as the number of dummy agents grows")
+    dummies.add_argument('--dummies', type=int, nargs='+', default=[1000, 10000, 40000])
+    dummies.add_argument('--grid-size', type=int, nargs=2, default=[100, 100])
+    dummies.add_argument('--lane-capacity', type=int, default=1)
+    dummies.add_argument('--environment', choices=sorted(environments), default='vectorized')
+    dummies.add_argument('--repeat', type=int, default=3)
+    dummies.add_argument('--steps', type=int, default=3)
+    dummies.set_defaults(func=bench_dummies)
+
+    suite = subparsers.add_parser('suite', help="fixed-seed headless scenarios, saved as JSON")
+    suite.add_argument('--scenarios', nargs='+', choices=[scenario['name'] for scenario in scenarios],
+                       help="scenarios to run (default: all)")
+    suite.add_argument('--seed', type=int, default=0)
+    suite.add_argument('--profile', action='store_true', help="add the time spent in each phase of a step")
+    suite.add_argument('--output', default=os.path.join('logs', 'benchmarks.json'), help="JSON file to write the results to")
+    suite.add_argument('--baseline', help="JSON results of an earlier run to compare steps/sec against")
+    suite.add_argument('--threshold', type=float, default=0.1, help="slowdown counted as a regression (default: 0.1)")
+    suite.set_defaults(func=bench_suite)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,15 @@
-import random
-import math
+import os
+import cPickle as pickle
 from environment import Agent, Environment
 from planner import RoutePlanner
 from simulator import Simulator
+from rng import stream
+from schedules import make_schedule
 
 class LearningAgent(Agent):
     """ An agent that learns to drive in the Smartcab world.""" 
 
-    def __init__(self, env, learning=False, epsilon=1.0, alpha=0.5):
+    def __init__(self, env, learning=False, epsilon=1.0, alpha=0.5, decay='cosine', dense=False, seed=None):
         super(LearningAgent, self).__init__(env)     # Set the agent in the evironment 
         self.planner = RoutePlanner(self.env, self)  # Create a route planner
         self.valid_actions = self.env.valid_actions  # The set of valid actions
@@ -17,6 +19,19 @@ class LearningAgent(Agent):
         self.Q = dict()          # Create a Q-table which will be a dictionary of tuples
         self.epsilon = epsilon   # Random exploration factor
         self.alpha = alpha       # Learning factor
+        self.decay = decay       # Epsilon decay schedule, as given (see schedules.py)
+        self.schedule = make_schedule(decay)
+        self.net_reward = 0.0    # Reward earned so far in the current trial
+
+        # Random stream for exploration; derived from the environment's seed unless given
+        self.random = stream(seed if seed is not None else self.env.seed, 'agent')
+
+        # Optionally store the Q-table as a NumPy array over the whole state space
+        self.dense = dense
+        if self.dense:
+            from qtable import StateEncoder, DenseQTable
+            encoder = StateEncoder([self.valid_actions, ['green', 'red'], self.valid_actions, self.valid_actions])
+            self.Q = DenseQTable(encoder, self.valid_actions)
 
         ###########
         ## TO DO ##
@@ -43,12 +58,11 @@ class LearningAgent(Agent):
             self.epsilon = 0.0
             self.alpha = 0.0
         else:
-            # self.epsilon -= 0.05
-            # self.epsilon = (self.alpha)**self.t
-            # self.epsilon = 1.0/self.t**2
-            # self.epsilon = math.exp(-self.alpha*self.t)
-            self.epsilon = math.fabs(math.cos(self.alpha*self.t))
+            if self.t > 0:
+                self.schedule.observe(self.net_reward)
+            self.epsilon = self.schedule(self.epsilon, self.alpha, self.t)
             self.t += 1.0
+        self.net_reward = 0.0
             
         return None
 
@@ -86,6 +100,9 @@ class LearningAgent(Agent):
         ###########
         # Calculate the maximum Q-value of all actions for a given state
 
+        if self.dense:
+            return self.Q.max(state)
+
         maxQ = None
         for action in self.Q[state]:
             if self.Q[state][action] > maxQ:
@@ -105,7 +122,10 @@ class LearningAgent(Agent):
         #   Then, for each action available, set the initial Q-value to 0.0
 
         if self.learning:
-            self.Q[state] = self.Q.get(state, {'forward':0.0, 'left':0.0, 'right':0.0, None:0.0})
+            if self.dense:
+                self.Q.create(state)
+            else:
+                self.Q[state] = self.Q.get(state, {'forward':0.0, 'left':0.0, 'right':0.0, None:0.0})
         return
 
 
@@ -126,15 +146,17 @@ class LearningAgent(Agent):
         # Be sure that when choosing an action with highest Q-value that you randomly select between actions that "tie".
 
         if not self.learning:
-            action = random.choice(self.valid_actions)
+            action = self.random.choice(self.valid_actions)
 
         else:
-            if self.epsilon > random.random():
-                action = random.choice(self.valid_actions)
+            if self.epsilon > self.random.random():
+                action = self.random.choice(self.valid_actions)
+            elif self.dense:
+                action = self.random.choice(self.Q.best_actions(state))
             else:
                 maxQ = self.get_maxQ(state)
                 actions = [move for move in self.Q[state] if self.Q[state][move] == maxQ]
-                action = random.choice(actions)
+                action = self.random.choice(actions)
         return action
 
 
@@ -149,7 +171,10 @@ class LearningAgent(Agent):
         # When learning, implement the value iteration update rule
         #   Use only the learning rate 'alpha' (do not use the discount factor 'gamma')
         if self.learning:
-            self.Q[state][action] = self.Q[state][action] + self.alpha*(reward - self.Q[state][action])
+            if self.dense:
+                self.Q.update(state, action, reward, self.alpha)
+            else:
+                self.Q[state][action] = self.Q[state][action] + self.alpha*(reward - self.Q[state][action])
         return
 
 
@@ -163,10 +188,199 @@ class LearningAgent(Agent):
         action = self.choose_action(state)  # Choose an action
         reward = self.env.act(self, action) # Receive a reward
         self.learn(state, action, reward)   # Q-learn
+        self.net_reward += reward
 
         return
+
+
+    def flush(self):
+        """ Learn anything still pending. LearningAgent learns every step as it acts,
+            so there is nothing to learn; agents that learn late override this. """
+
+        pass
+
+
+    def save_checkpoint(self, filename, trials):
+        """ Save the Q-table and the learning parameters after 'trials' completed trials.
+            The file is replaced atomically, so an interrupted save leaves the previous checkpoint. """
+
+        self.flush()
+        checkpoint = {
+            'Q': dict(self.Q.iteritems()),
+            'epsilon': self.epsilon,
+            'alpha': self.alpha,
+            'decay': self.decay,
+            'schedule': self.schedule,
+            't': self.t,
+            'net_reward': self.net_reward,  # Observed by the schedule at the next reset
+            'trials': trials
+        }
+        with open(filename + '.tmp', 'wb') as f:
+            pickle.dump(checkpoint, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(filename + '.tmp', filename)
+
+
+    def load_checkpoint(self, filename):
+        """ Restore the Q-table and the learning parameters saved by save_checkpoint.
+            Returns the number of trials completed when it was saved. """
+
+        with open(filename, 'rb') as f:
+            checkpoint = pickle.load(f)
+
+        if self.dense:
+            for state, values in checkpoint['Q'].iteritems():
+                self.Q.set(state, values)
+        else:
+            self.Q = checkpoint['Q']
+        self.epsilon = checkpoint['epsilon']
+        self.alpha = checkpoint['alpha']
+        self.decay = checkpoint['decay']
+        self.schedule = checkpoint['schedule']
+        self.t = checkpoint['t']
+        self.net_reward = checkpoint.get('net_reward', 0.0)
+        return checkpoint['trials']
         
 
+class TDAgent(LearningAgent):
+    """ A learning agent that also values the state it drives into: discounted
+        Q-learning, SARSA, or SARSA(lambda) with eligibility traces.
+
+        Each transition is learned one step late, once the next state (and, for
+        SARSA, the next action) is known. The last transition of a trial is
+        learned as terminal by flush(), when the next trial starts or the agent is
+        checkpointed, whichever comes first. """
+
+    methods = ['q', 'sarsa']
+
+    def __init__(self, env, learning=False, epsilon=1.0, alpha=0.5, decay='cosine', dense=False, seed=None,
+                 gamma=0.5, method='q', trace_decay=0.0):
+        super(TDAgent, self).__init__(env, learning=learning, epsilon=epsilon, alpha=alpha, decay=decay, dense=dense, seed=seed)
+        if method not in self.methods:
+            raise ValueError("TDAgent: method must be one of {}; got {!r}".format(self.methods, method))
+        if trace_decay != 0 and method != 'sarsa':
+            raise ValueError("TDAgent: trace_decay only applies to method='sarsa'; got {!r} with method={!r}".format(trace_decay, method))
+
+        self.gamma = gamma              # Discount factor of the value of the next state
+        self.method = method            # 'q' for Q-learning, 'sarsa' for SARSA
+        self.trace_decay = trace_decay  # Lambda of SARSA(lambda); 0 for one-step updates
+        self.traces = {}                # Eligibility of each (state, action) pair in this trial
+        self.previous = None            # (state, action, reward) still to be learned
+
+    def reset(self, destination=None, testing=False):
+        """ Learn the last transition of the finished trial, then reset as LearningAgent does. """
+
+        self.flush()
+        self.traces = {}
+        super(TDAgent, self).reset(destination=destination, testing=testing)
+
+    def flush(self):
+        """ Learn the last transition of the trial as terminal, if it has not been learned yet. """
+
+        if self.previous is not None:
+            self.learn(*self.previous)
+        self.previous = None
+
+    def get_Q(self, state, action):
+        """ Returns the Q-value of ('state', 'action'). """
+
+        if self.dense:
+            return self.Q.get(state, action)
+        return self.Q[state][action]
+
+    def add_Q(self, state, action, amount):
+        """ Adds 'amount' to the Q-value of ('state', 'action'). """
+
+        if self.dense:
+            self.Q.add(state, action, amount)
+        else:
+            self.Q[state][action] += amount
+
+    def learn(self, state, action, reward, next_state=None, next_action=None):
+        """ Move Q('state', 'action') towards 'reward' plus the discounted value of 'next_state':
+            its best action for Q-learning, 'next_action' for SARSA. Without a next state the
+            transition is terminal. With a trace decay, every pair visited in the trial is
+            updated in proportion to its eligibility. """
+
+        if not self.learning:
+            return
+
+        target = reward
+        if next_state is not None:
+            if self.method == 'q':
+                target += self.gamma * self.get_maxQ(next_state)
+            else:
+                target += self.gamma * self.get_Q(next_state, next_action)
+        delta = target - self.get_Q(state, action)
+
+        if self.method == 'q' or self.trace_decay == 0:
+            self.add_Q(state, action, self.alpha * delta)
+            return
+
+        # Replacing traces: the pair just visited is fully eligible, earlier pairs decay
+        self.traces[(state, action)] = 1.0
+        decay = self.gamma * self.trace_decay
+        for (traced_state, traced_action), trace in self.traces.items():
+            self.add_Q(traced_state, traced_action, self.alpha * delta * trace)
+            if trace * decay < 1e-4:
+                del self.traces[(traced_state, traced_action)]
+            else:
+                self.traces[(traced_state, traced_action)] = trace * decay
+
+    def update(self):
+        """ Build the state, learn the previous transition now that its next state is
+            known, and act. """
+
+        state = self.build_state()          # Get current state
+        self.createQ(state)                 # Create 'state' in Q-table
+
+        # Q-learning chooses from the updated Q-values; SARSA needs the next action to update
+        if self.method == 'q':
+            if self.previous is not None:
+                self.learn(*self.previous, next_state=state)
+            action = self.choose_action(state)
+        else:
+            action = self.choose_action(state)
+            if self.previous is not None:
+                self.learn(*self.previous, next_state=state, next_action=action)
+
+        reward = self.env.act(self, action) # Receive a reward
+        self.net_reward += reward
+        self.previous = (state, action, reward)
+
+        return
+
+
+class ReplayAgent(TDAgent):
+    """ A TDAgent using Q-learning that also keeps its past transitions in a replay
+        buffer (see experience.py). After each online update it learns again from a
+        mini-batch sampled from the buffer, so every simulated step is reused many
+        times. Requires NumPy, and always uses the dense Q-table. """
+
+    def __init__(self, env, learning=False, epsilon=1.0, alpha=0.5, decay='cosine', seed=None,
+                 gamma=0.5, capacity=10000, batch_size=32):
+        super(ReplayAgent, self).__init__(env, learning=learning, epsilon=epsilon, alpha=alpha, decay=decay,
+                                          dense=True, seed=seed, gamma=gamma, method='q')
+        from experience import ReplayBuffer
+        self.memory = ReplayBuffer(capacity, seed=self.random.getrandbits(32))
+        self.batch_size = batch_size  # Transitions replayed after each step
+
+    def learn(self, state, action, reward, next_state=None, next_action=None):
+        """ Learn the transition as TDAgent does, store it, and replay a mini-batch. """
+
+        super(ReplayAgent, self).learn(state, action, reward, next_state=next_state, next_action=next_action)
+
+        # Nothing is learned in testing trials, where alpha is 0
+        if not self.learning or self.alpha == 0:
+            return
+
+        encoder = self.Q.encoder
+        self.memory.add(encoder.encode(state), self.Q.action_index[action], reward,
+                        encoder.encode(next_state) if next_state is not None else -1)
+        if len(self.memory) >= self.batch_size:
+            states, actions, rewards, next_states = self.memory.sample(self.batch_size)
+            self.Q.update_batch(states, actions, rewards, next_states, self.alpha, self.gamma)
+
+
 def run():
     """ Driving function for running the simulation. 
         Press ESC to close the simulation, or [SPACE] to pause the simulation. """
@@ -177,6 +391,9 @@ def run():
     #   verbose     - set to True to display additional output from the simulation
     #   num_dummies - discrete number of dummy agents in the environment, default is 100
     #   grid_size   - discrete number of intersections (columns, rows), default is (8, 6)
+    #   seed        - seed for the environment's random streams, default is None (global random)
+    #   density     - dummy agents per intersection, used in place of num_dummies, default is None
+    #   lane_capacity - dummy agents that may start at the same intersection and heading, default is 1
     env = Environment()
     
     ##############
@@ -185,6 +402,17 @@ def run():
     #   learning   - set to True to force the driving agent to use Q-learning
     #    * epsilon - continuous value for the exploration factor, default is 1
     #    * alpha   - continuous value for the learning rate, default is 0.5
+    #    * decay   - epsilon decay schedule: a name in schedules.py, a dict with its 'name' and
+    #                parameters, or a JSON file holding that dict, default is 'cosine'
+    #    * dense   - set to True to store the Q-table as a NumPy array (see qtable.py)
+    #    * seed    - seed for the agent's exploration, default is derived from the environment seed
+    #   Use TDAgent instead of LearningAgent to learn from the value of the next state:
+    #    * gamma       - discount factor of the next state's value, default is 0.5
+    #    * method      - 'q' for Q-learning or 'sarsa' for SARSA, default is 'q'
+    #    * trace_decay - lambda of SARSA(lambda) eligibility traces, default is 0 (one-step); sarsa only
+    #   Use ReplayAgent to also learn from mini-batches of past transitions (requires NumPy):
+    #    * capacity    - discrete number of transitions kept for replay, default is 10000
+    #    * batch_size  - discrete number of transitions replayed after each step, default is 32
     agent = env.create_agent(LearningAgent, learning = True, epsilon = 0.5, alpha = 0.1)
     
     ##############
@@ -200,6 +428,17 @@ def run():
     #   display      - set to False to disable the GUI if PyGame is enabled
     #   log_metrics  - set to True to log trial and simulation results to /logs
     #   optimized    - set to True to change the default log file name
+    #   log_format   - 'csv' (default) or 'npz' to save typed metric columns in bulk (see metrics.py)
+    #   fast_forward - set to True to step without delay or per-step output (disables the GUI)
+    #   record_trials - set to True to keep the logged trial metrics in memory (Simulator.trial_log)
+    #   profile      - set to True to report time spent in each phase of a step (see profiler.py)
+    #   fps          - render at most this many frames per second, stepping as fast as possible in between
+    #   speed        - with fps, step at this multiple of the update_delay pace instead of as fast as possible
+    #   capture      - a FrameCapture to save the frames of selected trials as PNG files (see capture.py)
+    #   checkpoint   - file to save the Q-table to during training, and to resume from if it exists
+    #   checkpoint_every - discrete number of training trials between checkpoints, default is 10
+    #   background_log - set to True to write log rows from a background thread (see background.py)
+    #   monitor_port - serve the run's progress as JSON at http://127.0.0.1:<port>/status (see monitor.py)
     sim = Simulator(env, update_delay = 0.01, display = True, log_metrics = True, optimized = True)
     
     ##############
@@ -0,0 +1,61 @@
+import threading
+from Queue import Queue
+
+_stop = object()  # Queued by close() to stop the writer thread
+
+
+class BackgroundWriter(object):
+    """Writes rows through another writer from a background thread.
+
+    Wraps any object with a writerow() method, such as a csv.DictWriter or a
+    TrialMetrics. writerow() only queues a copy of the row and returns, so a
+    slow disk does not hold up the simulation; the rows are written in order
+    by a daemon thread. close() waits for every queued row to be written,
+    then closes 'file' if one is given, or the wrapped writer if it has a
+    close() method. An error raised while writing is raised again by the next
+    writerow() or by close().
+    """
+
+    def __init__(self, writer, file=None, max_queued=0):
+        self.writer = writer
+        self.file = file
+        self.queue = Queue(max_queued)  # Rows waiting to be written; writerow() blocks when full, unless 0
+        self.error = None
+        self.written = 0
+        self.thread = threading.Thread(target=self.work, name="BackgroundWriter")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def work(self):
+        """ Write queued rows until close() is called. Runs in the writer thread. """
+
+        while True:
+            row = self.queue.get()
+            if row is _stop:
+                break
+            if self.error is not None:
+                continue  # Drain the queue without writing after an error
+            try:
+                self.writer.writerow(row)
+                self.written += 1
+            except Exception as e:
+                self.error = e
+
+    def writerow(self, row):
+        """ Queue a copy of 'row' to be written. """
+
+        if self.error is not None:
+            raise self.error
+        self.queue.put(dict(row))
+
+    def close(self):
+        """ Write every queued row, then close the file or the wrapped writer. """
+
+        self.queue.put(_stop)
+        self.thread.join()
+        if self.file is not None:
+            self.file.close()
+        elif hasattr(self.writer, 'close'):
+            self.writer.close()
+        if self.error is not None:
+            raise self.error
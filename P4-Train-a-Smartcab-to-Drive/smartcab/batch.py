@@ -0,0 +1,113 @@
+import time
+from environment import Environment
+from agent import LearningAgent
+
+
+class EnvironmentBatch(object):
+    """Steps several independent environments in lockstep with a shared Q-table.
+
+    Each environment is created with its own seed and has its own primary agent,
+    but all agents share the Q-table of the first one, so every step of every
+    environment adds to the same table.
+    Each agent keeps its own epsilon and alpha schedule. An environment is reset
+    as soon as its trial is done, and switches to testing trials by the same
+    rules as Simulator.run.
+    """
+
+    def __init__(self, num_envs=4, seeds=None, agent_class=LearningAgent, agent_kwargs=None,
+                 environment=Environment, env_kwargs=None, enforce_deadline=True):
+        self.seeds = seeds if seeds is not None else range(num_envs)
+        agent_kwargs = agent_kwargs if agent_kwargs is not None else {'learning': True}
+        env_kwargs = env_kwargs if env_kwargs is not None else {}
+
+        self.envs = []
+        self.agents = []
+        for seed in self.seeds:
+            env = environment(seed=seed, **env_kwargs)
+            env.quiet = True
+            agent = env.create_agent(agent_class, **agent_kwargs)
+            env.set_primary_agent(agent, enforce_deadline=enforce_deadline)
+            if self.agents:
+                agent.Q = self.agents[0].Q  # Share a single Q-table
+            self.envs.append(env)
+            self.agents.append(agent)
+
+        self.Q = self.agents[0].Q
+
+        # Metrics of each finished trial, with the index of its environment
+        self.trial_log = []
+        self.trials_run = 0
+        self.steps_run = 0
+        self.run_time = 0.0
+
+    def start_trial(self, k):
+        """ Flip the testing switch of environment 'k' as Simulator.run does, then reset it.
+            Returns False once the environment has completed all of its testing trials. """
+
+        agent = self.agents[k]
+        progress = self.progress[k]
+
+        # Must complete minimum 20 training trials; assumes epsilon decays to 0
+        if not progress['testing']:
+            if progress['total_trials'] > 20 and (not agent.learning or agent.epsilon < self.tolerance):
+                progress['testing'] = True
+                progress['trial'] = 1
+
+        # Stop once the limit of testing trials is reached
+        elif progress['trial'] > self.n_test:
+            return False
+
+        self.envs[k].reset(progress['testing'])
+        return True
+
+    def finish_trial(self, k):
+        """ Record the metrics of the trial that environment 'k' just finished. """
+
+        env = self.envs[k]
+        progress = self.progress[k]
+        self.trial_log.append({
+            'env': k,
+            'trial': progress['trial'],
+            'testing': env.trial_data['testing'],
+            'parameters': env.trial_data['parameters'],
+            'initial_deadline': env.trial_data['initial_deadline'],
+            'final_deadline': env.trial_data['final_deadline'],
+            'net_reward': env.trial_data['net_reward'],
+            'actions': env.trial_data['actions'],
+            'success': env.trial_data['success']
+        })
+        progress['total_trials'] += 1
+        progress['trial'] += 1
+        self.trials_run += 1
+
+    def run(self, tolerance=0.05, n_test=0):
+        """ Step all environments together until each has finished its testing trials.
+
+        'tolerance' is the minimum epsilon necessary to begin testing (if enabled)
+        'n_test' is the number of testing trials simulated per environment """
+
+        self.tolerance = tolerance
+        self.n_test = n_test
+        self.progress = [{'total_trials': 1, 'trial': 1, 'testing': False} for _ in self.envs]
+        self.trial_log = []
+        self.trials_run = 0
+        self.steps_run = 0
+        start = time.time()
+
+        active = [k for k in xrange(len(self.envs)) if self.start_trial(k)]
+        while active:
+            for k in active:
+                self.envs[k].step()
+            self.steps_run += len(active)
+
+            # Reset each environment whose trial is done
+            still_active = []
+            for k in active:
+                if self.envs[k].done:
+                    self.finish_trial(k)
+                    if not self.start_trial(k):
+                        continue
+                still_active.append(k)
+            active = still_active
+
+        self.run_time = time.time() - start
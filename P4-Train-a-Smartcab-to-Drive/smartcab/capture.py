@@ -0,0 +1,55 @@
+import os
+import shutil
+import pygame
+
+
+class FrameCapture(object):
+    """Saves the frames of selected trials as PNG sequences, one directory per trial.
+
+    Pass it to Simulator(capture=...). Without a display, the simulator renders
+    off-screen through SDL's dummy video driver, so this works on servers with
+    no display, including with fast_forward=True. Only every 'every'-th trial is
+    captured; with failed_only=True the frames of a trial that reached its
+    destination are deleted once it ends.
+    """
+
+    def __init__(self, directory, every=1, failed_only=False):
+        self.directory = directory
+        self.every = every
+        self.failed_only = failed_only
+        self.trial_directory = None  # Directory of the trial being captured, if any
+        self.frame = 0
+        self.captured = []           # Directories of the trials kept so far
+
+    def start_trial(self, count, trial, testing):
+        """ Called by Simulator.run before trial number 'count' of the run starts.
+            Returns True if the trial is captured. """
+
+        self.trial_directory = None
+        if (count - 1) % self.every != 0:
+            return False
+
+        self.trial_directory = os.path.join(self.directory, "{}_{:04d}".format("testing" if testing else "training", trial))
+        if not os.path.isdir(self.trial_directory):
+            os.makedirs(self.trial_directory)
+        self.frame = 0
+        return True
+
+    def save(self, surface):
+        """ Write 'surface' as the next frame of the trial being captured. """
+
+        if self.trial_directory is None:
+            return
+        pygame.image.save(surface, os.path.join(self.trial_directory, "frame_{:05d}.png".format(self.frame)))
+        self.frame += 1
+
+    def finish_trial(self, success):
+        """ Called by Simulator.run once a captured trial ends. """
+
+        if self.trial_directory is None:
+            return
+        if self.failed_only and success:
+            shutil.rmtree(self.trial_directory)
+        else:
+            self.captured.append(self.trial_directory)
+        self.trial_directory = None
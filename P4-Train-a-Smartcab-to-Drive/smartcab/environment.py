@@ -1,8 +1,10 @@
 import time
 import random
 import math
+import bisect
 from collections import OrderedDict
 from simulator import Simulator
+from rng import stream
 
 
 class TrafficLight(object):
@@ -10,9 +12,9 @@ class TrafficLight(object):
 
     valid_states = [True, False]  # True = NS open; False = EW open
 
-    def __init__(self, state=None, period=None):
-        self.state = state if state is not None else random.choice(self.valid_states)
-        self.period = period if period is not None else random.choice([2, 3, 4, 5])
+    def __init__(self, state=None, period=None, rng=random):
+        self.state = state if state is not None else rng.choice(self.valid_states)
+        self.period = period if period is not None else rng.choice([2, 3, 4, 5])
         self.last_updated = 0
 
     def reset(self):
@@ -24,6 +26,51 @@ class TrafficLight(object):
             self.last_updated = t
 
 
+class LightScheduler(object):
+    """Switches each traffic light when it is due, instead of checking every light on every step.
+
+    Every light restarts its cycle at the start of a trial, so a light with
+    period p switches exactly at the multiples of p. Lights are kept in buckets
+    by period, and an update only touches the buckets due at that time. 'states'
+    holds the state of every light in a bytearray, in the order of the lights
+    given, so that all of them can be read at once; 'changed' holds the indices
+    of the lights switched since it was last cleared. Both stay in sync with the
+    TrafficLight objects as long as lights are switched through the scheduler.
+    """
+
+    def __init__(self, lights):
+        self.lights = lights
+        self.states = bytearray(light.state for light in lights)
+        self.changed = set()
+        self.periods = {}  # period -> indices of the lights with that period
+        for i, light in enumerate(lights):
+            self.periods.setdefault(light.period, []).append(i)
+
+    def reset(self):
+        """ Restart the cycle of every light; called at the start of each trial. """
+
+        for light in self.lights:
+            light.reset()
+
+    def update(self, t):
+        """ Switch the lights due at time 't', as TrafficLight.update(t) would. """
+
+        if t == 0:
+            return
+        lights = self.lights
+        states = self.states
+        for period, due in self.periods.iteritems():
+            if t % period != 0:
+                continue
+            for i in due:
+                light = lights[i]
+                state = not light.state
+                light.state = state
+                light.last_updated = t
+                states[i] = state
+            self.changed.update(due)
+
+
 class Environment(object):
     """Environment within which all agents operate."""
 
@@ -32,9 +79,22 @@ class Environment(object):
     valid_headings = [(1, 0), (0, -1), (-1, 0), (0, 1)]  # E, N, W, S
     hard_time_limit = -100  # Set a hard time limit even if deadline is not enforced.
 
-    def __init__(self, verbose=False, num_dummies=100, grid_size = (8, 6)):
+    def __init__(self, verbose=False, num_dummies=100, grid_size = (8, 6), spatial_index=True, seed=None,
+                 density=None, lane_capacity=1):
         self.num_dummies = num_dummies  # Number of dummy driver agents in the environment
+        self.density = density  # If set, dummy agents per intersection, in place of num_dummies
+        self.lane_capacity = lane_capacity  # Dummy agents that may start at each intersection and heading
         self.verbose = verbose # If debug output should be given
+        self.quiet = False # If per-step output should be suppressed
+        self.recorder = None # Optional TrajectoryRecorder (see recorder.py)
+
+        # Independent random streams for placement, reward noise, traffic lights and dummy agents
+        # (see rng.py); with seed None they all share the global random module
+        self.seed = seed
+        self.random = stream(seed, 'environment')
+        self.reward_random = stream(seed, 'rewards')
+        self.light_random = stream(seed, 'lights')
+        self.dummy_random = stream(seed, 'dummies')
 
         # Initialize simulation variables
         self.done = False
@@ -43,33 +103,33 @@ class Environment(object):
         self.step_data = {}
         self.success = None
 
+        # Index of the agents at each intersection, kept in creation order
+        # so that sense() sees co-located agents in the same order as a full scan
+        self.spatial_index = spatial_index
+        self.agent_order = {}
+        self.occupants = {}
+
         # Road network
         self.grid_size = grid_size  # (columns, rows)
         self.bounds = (1, 2, self.grid_size[0], self.grid_size[1] + 1)
         self.block_size = 100
         self.hang = 0.6
         self.intersections = OrderedDict()
-        self.roads = []
         for x in xrange(self.bounds[0], self.bounds[2] + 1):
             for y in xrange(self.bounds[1], self.bounds[3] + 1):
-                self.intersections[(x, y)] = TrafficLight()  # A traffic light at each intersection
-
-        for a in self.intersections:
-            for b in self.intersections:
-                if a == b:
-                    continue
-                if (abs(a[0] - b[0]) + abs(a[1] - b[1])) == 1:  # L1 distance = 1
-                    self.roads.append((a, b))
-
-        # Add environment boundaries
-        for x in xrange(self.bounds[0], self.bounds[2] + 1):
-            self.roads.append(((x, self.bounds[1] - self.hang), (x, self.bounds[1])))
-            self.roads.append(((x, self.bounds[3] + self.hang), (x, self.bounds[3])))
-        for y in xrange(self.bounds[1], self.bounds[3] + 1):
-            self.roads.append(((self.bounds[0] - self.hang, y), (self.bounds[0], y)))
-            self.roads.append(((self.bounds[2] + self.hang, y), (self.bounds[2], y)))    
+                self.intersections[(x, y)] = TrafficLight(rng=self.light_random)  # A traffic light at each intersection
+        self.intersection_list = self.intersections.keys()  # Intersections in order, for random choices
+        self.lights = LightScheduler(self.intersections.values())
+        self.roads = self.build_roads()
+        self.edges = None  # Compact road network, built on first use by road_arrays()
 
         # Create dummy agents
+        if self.density is not None:
+            self.num_dummies = int(round(self.density * len(self.intersections)))
+        self.num_slots = len(self.intersections) * len(self.valid_headings) * self.lane_capacity
+        if self.num_dummies > self.num_slots:
+            raise ValueError("{} dummy agents do not fit on a {}x{} grid with a lane capacity of {}.".format(
+                self.num_dummies, self.grid_size[0], self.grid_size[1], self.lane_capacity))
         for i in xrange(self.num_dummies):
             self.create_agent(DummyAgent)
 
@@ -88,13 +148,75 @@ class Environment(object):
             'success': 0  # whether the agent reached the destination in time
         }
 
+    def build_roads(self):
+        """ Returns the roads between neighbouring intersections, and the roads leaving the
+            grid at its boundaries, as (start, end) pairs of points. """
+
+        roads = []
+        columns = (self.bounds[0], self.bounds[2])
+        rows = (self.bounds[1], self.bounds[3])
+
+        # Each road between neighbouring intersections appears once in each direction,
+        # ordered by the intersections' position in self.intersections
+        for x in xrange(columns[0], columns[1] + 1):
+            for y in xrange(rows[0], rows[1] + 1):
+                a = (x, y)
+                if x > columns[0]:
+                    roads.append((a, (x - 1, y)))
+                if y > rows[0]:
+                    roads.append((a, (x, y - 1)))
+                if y < rows[1]:
+                    roads.append((a, (x, y + 1)))
+                if x < columns[1]:
+                    roads.append((a, (x + 1, y)))
+
+        # Add environment boundaries
+        for x in xrange(columns[0], columns[1] + 1):
+            roads.append(((x, rows[0] - self.hang), (x, rows[0])))
+            roads.append(((x, rows[1] + self.hang), (x, rows[1])))
+        for y in xrange(rows[0], rows[1] + 1):
+            roads.append(((columns[0] - self.hang, y), (columns[0], y)))
+            roads.append(((columns[1] + self.hang, y), (columns[1], y)))
+        return roads
+
+    def road_arrays(self):
+        """ Returns the roads between neighbouring intersections as two NumPy arrays of
+            the same length, holding the index in self.intersection_list of the start and the end
+            of each road. The roads are in the same order as in self.roads. """
+
+        if self.edges is None:
+            import numpy as np
+            columns, rows = self.grid_size
+            index = np.arange(columns * rows).reshape(columns, rows)
+            sources = np.concatenate([index[1:, :].ravel(), index[:, 1:].ravel(), index[:, :-1].ravel(), index[:-1, :].ravel()])
+            targets = np.concatenate([index[:-1, :].ravel(), index[:, :-1].ravel(), index[:, 1:].ravel(), index[1:, :].ravel()])
+            order = np.lexsort((targets, sources))
+            self.edges = (sources[order].astype(np.int32), targets[order].astype(np.int32))
+        return self.edges
+
     def create_agent(self, agent_class, *args, **kwargs):
         """ When called, create_agent creates an agent in the environment. """
 
         agent = agent_class(self, *args, **kwargs)
-        self.agent_states[agent] = {'location': random.choice(self.intersections.keys()), 'heading': (0, 1)}
+        self.agent_states[agent] = {'location': self.random.choice(self.intersection_list), 'heading': (0, 1)}
+        self.agent_order[agent] = len(self.agent_order)
+        if self.spatial_index:
+            self.add_occupant(agent, self.agent_states[agent]['location'])
         return agent
 
+    def add_occupant(self, agent, location):
+        """ Add 'agent' to the spatial index at 'location'. """
+
+        bisect.insort(self.occupants.setdefault(location, []), (self.agent_order[agent], agent))
+
+    def remove_occupant(self, agent, location):
+        """ Remove 'agent' from the spatial index at 'location'. """
+
+        occupants = self.occupants[location]
+        occupants.remove((self.agent_order[agent], agent))
+        if not occupants:
+            del self.occupants[location]
+
     def set_primary_agent(self, agent, enforce_deadline=False):
         """ When called, set_primary_agent sets 'agent' as the primary agent.
             The primary agent is the smartcab that is followed in the environment. """
@@ -113,30 +235,35 @@ class Environment(object):
         self.step_data = {}
 
         # Reset traffic lights
-        for traffic_light in self.intersections.itervalues():
-            traffic_light.reset()
+        self.lights.reset()
 
         # Pick a start and a destination
-        start = random.choice(self.intersections.keys())
-        destination = random.choice(self.intersections.keys())
+        start = self.random.choice(self.intersection_list)
+        destination = self.random.choice(self.intersection_list)
 
         # Ensure starting location and destination are not too close
         while self.compute_dist(start, destination) < 4:
-            start = random.choice(self.intersections.keys())
-            destination = random.choice(self.intersections.keys())
+            start = self.random.choice(self.intersection_list)
+            destination = self.random.choice(self.intersection_list)
 
-        start_heading = random.choice(self.valid_headings)
+        start_heading = self.random.choice(self.valid_headings)
         distance = self.compute_dist(start, destination)
         deadline = distance * 5 # 5 time steps per intersection away
         if(self.verbose == True): # Debugging
             print "Environment.reset(): Trial set up with start = {}, destination = {}, deadline = {}".format(start, destination, deadline)
 
-        # Create a map of all possible initial positions
-        positions = dict()
-        for location in self.intersections:
-            positions[location] = list()
-            for heading in self.valid_headings:
-                positions[location].append(heading)
+        # Give each dummy agent its own starting slot: an intersection, a heading and
+        # one of the lane_capacity places on that approach
+        dummies = [agent for agent in self.agent_states if agent is not self.primary_agent]
+        slots = self.random.sample(xrange(self.num_slots), len(dummies))
+        for agent, slot in zip(dummies, slots):
+            place = slot // self.lane_capacity
+            self.agent_states[agent] = {
+                'location': self.intersection_list[place // len(self.valid_headings)],
+                'heading': self.valid_headings[place % len(self.valid_headings)],
+                'destination': None,
+                'deadline': None
+            }
 
         # Initialize agent(s)
         for agent in self.agent_states.iterkeys():
@@ -148,23 +275,7 @@ class Environment(object):
                     'destination': destination,
                     'deadline': deadline
                 }
-            # For dummy agents, make them choose one of the available 
-            # intersections and headings still in 'positions'
-            else:
-                intersection = random.choice(positions.keys())
-                heading = random.choice(positions[intersection])
-                self.agent_states[agent] = {
-                    'location': intersection,
-                    'heading': heading,
-                    'destination': None,
-                    'deadline': None
-                }
-                # Now delete the taken location and heading from 'positions'
-                positions[intersection] = list(set(positions[intersection]) - set([heading]))
-                if positions[intersection] == list(): # No headings available for intersection
-                    del positions[intersection] # Delete the intersection altogether
 
-    
             agent.reset(destination=(destination if agent is self.primary_agent else None), testing=testing)
             if agent is self.primary_agent:
                 # Reset metrics for this trial (step data will be set during the step)
@@ -176,15 +287,25 @@ class Environment(object):
                 self.trial_data['parameters'] = {'e': agent.epsilon, 'a': agent.alpha}
                 self.trial_data['success'] = 0
 
+        # Rebuild the spatial index from the new positions
+        if self.spatial_index:
+            self.occupants = {}
+            for agent, state in self.agent_states.iteritems():
+                self.occupants.setdefault(state['location'], []).append((self.agent_order[agent], agent))
+
+        if self.recorder is not None and self.primary_agent is not None:
+            self.recorder.start_trial(self, testing)
+
     def step(self):
         """ This function is called when a time step is taken turing a trial. """
 
         # Pretty print to terminal
-        print ""
-        print "/-------------------"
-        print "| Step {} Results".format(self.t)
-        print "\-------------------"
-        print ""
+        if not self.quiet:
+            print ""
+            print "/-------------------"
+            print "| Step {} Results".format(self.t)
+            print "\-------------------"
+            print ""
 
         if(self.verbose == True): # Debugging
             print "Environment.step(): t = {}".format(self.t)
@@ -193,13 +314,8 @@ class Environment(object):
         if self.primary_agent is not None:
             self.primary_agent.update()
 
-        for agent in self.agent_states.iterkeys():
-            if agent is not self.primary_agent:
-                agent.update()
-
-        # Update traffic lights
-        for intersection, traffic_light in self.intersections.iteritems():
-            traffic_light.update(self.t)
+        self.update_dummies()
+        self.update_lights()
 
         if self.primary_agent is not None:
             # Agent has taken an action: reduce the deadline by 1
@@ -219,6 +335,20 @@ class Environment(object):
 
         self.t += 1
 
+    def update_lights(self):
+        """ This function is called during a step, once every agent has acted.
+            The traffic lights due to switch at the current time are switched. """
+
+        self.lights.update(self.t)
+
+    def update_dummies(self):
+        """ This function is called during a step, once the primary agent has acted.
+            Each dummy agent senses and moves in turn. """
+
+        for agent in self.agent_states.iterkeys():
+            if agent is not self.primary_agent:
+                agent.update()
+
     def sense(self, agent):
         """ This function is called when information is requested about the sensor
             inputs from an 'agent' in the environment. """
@@ -230,11 +360,17 @@ class Environment(object):
         heading = state['heading']
         light = 'green' if (self.intersections[location].state and heading[1] != 0) or ((not self.intersections[location].state) and heading[0] != 0) else 'red'
 
+        # Only agents at the same intersection can affect the inputs
+        if self.spatial_index:
+            others = [(other_agent, self.agent_states[other_agent]) for order, other_agent in self.occupants[location]]
+        else:
+            others = self.agent_states.iteritems()
+
         # Populate oncoming, left, right
         oncoming = None
         left = None
         right = None
-        for other_agent, other_state in self.agent_states.iteritems():
+        for other_agent, other_state in others:
             if agent == other_agent or location != other_state['location'] or (heading[0] == other_state['heading'][0] and heading[1] == other_state['heading'][1]):
                 continue
             # For dummy agents, ignore the primary agent
@@ -283,7 +419,7 @@ class Environment(object):
 
         # Reward scheme
         # First initialize reward uniformly random from [-1, 1]
-        reward = 2 * random.random() - 1
+        reward = 2 * self.reward_random.random() - 1
 
         # Create a penalty factor as a function of remaining deadline
         # Scales reward multiplicatively from [0, 1]
@@ -345,8 +481,12 @@ class Environment(object):
 
             # Move the agent
             if action is not None:
+                if self.spatial_index:
+                    self.remove_occupant(agent, location)
                 location = ((location[0] + heading[0] - self.bounds[0]) % (self.bounds[2] - self.bounds[0] + 1) + self.bounds[0],
                             (location[1] + heading[1] - self.bounds[1]) % (self.bounds[3] - self.bounds[1] + 1) + self.bounds[1])  # wrap-around
+                if self.spatial_index:
+                    self.add_occupant(agent, location)
                 state['location'] = location
                 state['heading'] = heading
         # Agent attempted invalid move
@@ -394,6 +534,9 @@ class Environment(object):
 
             if(self.verbose == True): # Debugging
                 print "Environment.act(): Step data: {}".format(self.step_data)
+
+        if self.recorder is not None:
+            self.recorder.record(self, agent, action, reward, violation)
         return reward
 
     def compute_dist(self, a, b):
@@ -439,8 +582,8 @@ class DummyAgent(Agent):
 
     def __init__(self, env):
         super(DummyAgent, self).__init__(env)  # sets self.env = env, state = None, next_waypoint = None, and a default color
-        self.next_waypoint = random.choice(Environment.valid_actions[1:])
-        self.color = random.choice(self.color_choices)
+        self.next_waypoint = self.env.dummy_random.choice(Environment.valid_actions[1:])
+        self.color = self.env.dummy_random.choice(self.color_choices)
 
     def update(self):
         """ Update a DummyAgent to move randomly under legal traffic laws. """
@@ -463,5 +606,5 @@ class DummyAgent(Agent):
         action = None
         if action_okay:
             action = self.next_waypoint
-            self.next_waypoint = random.choice(Environment.valid_actions[1:])
+            self.next_waypoint = self.env.dummy_random.choice(Environment.valid_actions[1:])
         reward = self.env.act(self, action)
\ No newline at end of file
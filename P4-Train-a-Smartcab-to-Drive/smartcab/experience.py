@@ -0,0 +1,41 @@
+import numpy as np
+
+
+class ReplayBuffer(object):
+    """Fixed-capacity store of past transitions, kept in NumPy ring arrays.
+
+    Each transition is an encoded state, an action index, a reward and an
+    encoded next state (-1 when the transition ended the trial). Once full, the
+    oldest transition is overwritten, so memory stays at 'capacity' entries.
+    """
+
+    def __init__(self, capacity=10000, seed=None):
+        self.capacity = capacity
+        self.states = np.zeros(capacity, dtype=np.int32)
+        self.actions = np.zeros(capacity, dtype=np.int8)
+        self.rewards = np.zeros(capacity)
+        self.next_states = np.zeros(capacity, dtype=np.int32)
+        self.size = 0      # Number of transitions stored
+        self.position = 0  # Where the next transition is written
+        self.random = np.random.RandomState(seed)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state, action, reward, next_state):
+        """ Store one transition, overwriting the oldest once the buffer is full. """
+
+        i = self.position
+        self.states[i] = state
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.next_states[i] = next_state
+        self.position = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def sample(self, batch_size):
+        """ Returns 'batch_size' transitions drawn uniformly with replacement,
+            as (states, actions, rewards, next_states) arrays. """
+
+        i = self.random.randint(0, self.size, size=batch_size)
+        return self.states[i], self.actions[i], self.rewards[i], self.next_states[i]
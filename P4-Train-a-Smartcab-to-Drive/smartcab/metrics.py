@@ -0,0 +1,101 @@
+import numpy as np
+from stats import action_columns
+
+# Column names and types of a trial-metrics log
+trial_columns = [
+    ('trial', np.int32),
+    ('testing', np.bool_),
+    ('epsilon', np.float64),
+    ('alpha', np.float64),
+    ('initial_deadline', np.int32),
+    ('final_deadline', np.int32),
+    ('net_reward', np.float64)
+] + [(name, np.int32) for name in action_columns] + [
+    ('success', np.int8)
+]
+
+
+class TrialMetrics(object):
+    """Columnar sink for the per-trial metrics logged by Simulator.
+
+    Rows are buffered in memory and converted to typed NumPy arrays in bulk
+    every 'buffer_size' trials. close() saves every column to a single .npz
+    file, with one integer column per violation class and float columns for
+    epsilon and alpha, so reading it back needs no parsing.
+    """
+
+    def __init__(self, filename, buffer_size=1000):
+        self.filename = filename
+        self.buffer_size = buffer_size
+        self.buffer = dict((name, []) for name, dtype in trial_columns)
+        self.chunks = dict((name, []) for name, dtype in trial_columns)
+        self.buffered = 0
+
+    def resume(self, trials):
+        """ Carry on the log saved in the .npz file, keeping only its first 'trials' trials. """
+
+        data = load_trials(self.filename)
+        for name, dtype in trial_columns:
+            self.chunks[name].append(data[name][:trials])
+
+    def writerow(self, metrics):
+        """ Buffer one trial, given as the row written by Simulator.log_metrics. """
+
+        self.buffer['trial'].append(metrics['trial'])
+        self.buffer['testing'].append(metrics['testing'])
+        self.buffer['epsilon'].append(metrics['parameters']['e'])
+        self.buffer['alpha'].append(metrics['parameters']['a'])
+        self.buffer['initial_deadline'].append(metrics['initial_deadline'])
+        self.buffer['final_deadline'].append(metrics['final_deadline'])
+        self.buffer['net_reward'].append(metrics['net_reward'])
+        for violation, name in enumerate(action_columns):
+            self.buffer[name].append(metrics['actions'][violation])
+        self.buffer['success'].append(metrics['success'])
+
+        self.buffered += 1
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """ Convert the buffered rows to typed arrays. """
+
+        for name, dtype in trial_columns:
+            self.chunks[name].append(np.array(self.buffer[name], dtype=dtype))
+            self.buffer[name] = []
+        self.buffered = 0
+
+    def columns(self):
+        """ Returns every trial recorded so far as a dictionary of column arrays. """
+
+        self.flush()
+        return dict((name, np.concatenate(self.chunks[name])) for name, dtype in trial_columns)
+
+    def close(self):
+        """ Save all recorded trials to the .npz file. """
+
+        np.savez_compressed(self.filename, **self.columns())
+
+
+def column_metrics(columns):
+    """ Yields the metrics of each trial, as Simulator passes them to TrialStats.update,
+        from columns such as those returned by load_trials. """
+
+    values = dict((name, columns[name].tolist()) for name, dtype in trial_columns)
+    for i in xrange(len(values['trial'])):
+        yield {
+            'trial': values['trial'][i],
+            'testing': values['testing'][i],
+            'parameters': {'e': values['epsilon'][i], 'a': values['alpha'][i]},
+            'initial_deadline': values['initial_deadline'][i],
+            'final_deadline': values['final_deadline'][i],
+            'net_reward': values['net_reward'][i],
+            'actions': dict((violation, values[name][i]) for violation, name in enumerate(action_columns)),
+            'success': values['success'][i]
+        }
+
+
+def load_trials(filename):
+    """ Returns the columns saved by TrialMetrics as a dictionary of arrays. """
+
+    with np.load(filename) as data:
+        return dict((name, data[name]) for name, dtype in trial_columns)
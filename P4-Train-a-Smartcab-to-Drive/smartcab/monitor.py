@@ -0,0 +1,79 @@
+import json
+import threading
+import time
+import BaseHTTPServer
+
+
+class StatusHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers GET / and GET /status with the status of the monitored simulation as JSON."""
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/status'):
+            self.send_error(404, "Not found; the status is served at /status")
+            return
+        body = json.dumps(self.server.monitor.status(), sort_keys=True)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep requests out of the simulation's output
+
+
+class StatusServer(object):
+    """Serves the progress of a running Simulator as JSON over HTTP, from a background thread.
+
+    Pass a port to Simulator(monitor_port=...) to start one for each run, then
+    read http://127.0.0.1:<port>/status while it runs. The server takes no lock
+    shared with the simulation: the simulator publishes a new summary of its
+    TrialStats at the end of each trial by replacing a reference, and the live
+    values (trial, step, epsilon, alpha, steps/sec and Q-table size) are read
+    from attributes that the step loop only ever rebinds.
+    """
+
+    def __init__(self, sim, port=8000, host='127.0.0.1'):
+        self.sim = sim
+        self.summary = {}  # TrialStats.summary() as of the last finished trial
+        self.server = BaseHTTPServer.HTTPServer((host, port), StatusHandler)
+        self.server.monitor = self
+        self.address = self.server.server_address
+        self.thread = threading.Thread(target=self.server.serve_forever, name="StatusServer")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def publish(self, summary):
+        """ Called by the simulator with the statistics of the trials finished so far. """
+
+        self.summary = summary
+
+    def status(self):
+        """ Returns the current status of the simulation as a dictionary. Runs in the server thread. """
+
+        sim = self.sim
+        agent = sim.env.primary_agent
+        trial, testing = sim.current_trial
+        elapsed = time.time() - sim.run_start if sim.run_start is not None else 0.0
+        learning = agent is not None and agent.learning
+        return {
+            'trial': trial,
+            'testing': testing,
+            'trials_run': sim.trials_run,
+            'step': sim.env.t,
+            'steps_run': sim.steps_run,
+            'elapsed': elapsed,
+            'steps_per_sec': sim.steps_run / elapsed if elapsed > 0 else None,
+            'trials_per_sec': sim.trials_run / elapsed if elapsed > 0 else None,
+            'epsilon': agent.epsilon if agent is not None else None,
+            'alpha': agent.alpha if agent is not None else None,
+            'q_states': len(agent.Q) if learning else 0,
+            'stats': self.summary
+        }
+
+    def close(self):
+        """ Stop serving and release the port. """
+
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
@@ -1,4 +1,81 @@
-import random
+# Waypoint lookup tables, built once per grid size
+waypoint_tables = {}
+
+
+def compute_waypoint(location, heading, destination, bounds):
+    """ Computes the next waypoint based on current heading, location,
+        intended destination and L1 distance from destination.
+        'bounds' is the grid size (columns, rows) of the world. """
+
+    delta_a = (destination[0] - location[0], destination[1] - location[1])
+    delta_b = (bounds[0] + delta_a[0] if delta_a[0] <= 0 else delta_a[0] - bounds[0], \
+               bounds[1] + delta_a[1] if delta_a[1] <= 0 else delta_a[1] - bounds[1])
+
+    # Calculate true difference in location based on world-wrap
+    # This will pre-determine the need for U-turns from improper headings
+    dx = delta_a[0] if abs(delta_a[0]) < abs(delta_b[0]) else delta_b[0]
+    dy = delta_a[1] if abs(delta_a[1]) < abs(delta_b[1]) else delta_b[1]
+
+    # First check if destination is at location
+    if dx == 0 and dy == 0:
+        return None
+    
+    # Next check if destination is cardinally East or West of location    
+    elif dx != 0:
+
+        if dx * heading[0] > 0:  # Heading the correct East or West direction
+            return 'forward'
+        elif dx * heading[0] < 0 and heading[0] < 0: # Heading West, destination East
+            if dy > 0: # Destination also to the South
+                return 'left'
+            else:
+                return 'right'
+        elif dx * heading[0] < 0 and heading[0] > 0: # Heading East, destination West
+            if dy < 0: # Destination also to the North
+                return 'left'
+            else:
+                return 'right'
+        elif dx * heading[1] > 0: # Heading North destination West; Heading South destination East
+            return 'left'
+        else:
+            return 'right'
+
+    # Finally, check if destination is cardinally North or South of location
+    elif dy != 0:
+
+        if dy * heading[1] > 0:  # Heading the correct North or South direction
+            return 'forward'
+        elif dy * heading[1] < 0 and heading[1] < 0: # Heading North, destination South
+            if dx < 0: # Destination also to the West
+                return 'left'
+            else:
+                return 'right'
+        elif dy * heading[1] < 0 and heading[1] > 0: # Heading South, destination North
+            if dx > 0: # Destination also to the East
+                return 'left'
+            else:
+                return 'right'
+        elif dy * heading[0] > 0: # Heading West destination North; Heading East destination South
+            return 'right'
+        else:
+            return 'left'
+
+
+def build_waypoint_table(grid_size, headings):
+    """ Tabulates compute_waypoint for every offset from location to destination and every heading.
+
+        The waypoint only depends on the raw offset (destination - location), so the table
+        has (2 * columns - 1) * (2 * rows - 1) * len(headings) entries. The offset is not
+        reduced modulo the grid size, because world-wrap ties are broken differently
+        for positive and negative offsets. """
+
+    table = []
+    for dx in xrange(1 - grid_size[0], grid_size[0]):
+        for dy in xrange(1 - grid_size[1], grid_size[1]):
+            for heading in headings:
+                table.append(compute_waypoint((0, 0), heading, (dx, dy), grid_size))
+    return table
+
 
 class RoutePlanner(object):
     """ Complex route planner that is meant for a perpendicular grid network. """
@@ -8,69 +85,28 @@ class RoutePlanner(object):
         self.agent = agent
         self.destination = None
 
+        # Precomputed waypoints for every offset and heading on this grid
+        if self.env.grid_size not in waypoint_tables:
+            waypoint_tables[self.env.grid_size] = build_waypoint_table(self.env.grid_size, self.env.valid_headings)
+        self.table = waypoint_tables[self.env.grid_size]
+        self.heading_index = dict((heading, i) for i, heading in enumerate(self.env.valid_headings))
+
+        # Table strides for a unit step in x and y, and the index of offset (0, 0)
+        self.y_stride = len(self.env.valid_headings)
+        self.x_stride = (2 * self.env.grid_size[1] - 1) * self.y_stride
+        self.origin = (self.env.grid_size[0] - 1) * self.x_stride + (self.env.grid_size[1] - 1) * self.y_stride
+        self.base = None
+
     def route_to(self, destination=None):
         """ Select the destination if one is provided, otherwise choose a random intersection. """
 
-        self.destination = destination if destination is not None else random.choice(self.env.intersections.keys())
+        self.destination = destination if destination is not None else self.env.random.choice(self.env.intersection_list)
+        self.base = self.origin + self.destination[0] * self.x_stride + self.destination[1] * self.y_stride
 
     def next_waypoint(self):
-        """ Creates the next waypoint based on current heading, location,
+        """ Looks up the next waypoint based on current heading, location,
             intended destination and L1 distance from destination. """
 
-        # Collect global location details
-        bounds = self.env.grid_size
-        location = self.env.agent_states[self.agent]['location']
-        heading = self.env.agent_states[self.agent]['heading']
-
-        delta_a = (self.destination[0] - location[0], self.destination[1] - location[1])
-        delta_b = (bounds[0] + delta_a[0] if delta_a[0] <= 0 else delta_a[0] - bounds[0], \
-                   bounds[1] + delta_a[1] if delta_a[1] <= 0 else delta_a[1] - bounds[1])
-
-        # Calculate true difference in location based on world-wrap
-        # This will pre-determine the need for U-turns from improper headings
-        dx = delta_a[0] if abs(delta_a[0]) < abs(delta_b[0]) else delta_b[0]
-        dy = delta_a[1] if abs(delta_a[1]) < abs(delta_b[1]) else delta_b[1]
-
-        # First check if destination is at location
-        if dx == 0 and dy == 0:
-            return None
-        
-        # Next check if destination is cardinally East or West of location    
-        elif dx != 0:
-
-            if dx * heading[0] > 0:  # Heading the correct East or West direction
-                return 'forward'
-            elif dx * heading[0] < 0 and heading[0] < 0: # Heading West, destination East
-                if dy > 0: # Destination also to the South
-                    return 'left'
-                else:
-                    return 'right'
-            elif dx * heading[0] < 0 and heading[0] > 0: # Heading East, destination West
-                if dy < 0: # Destination also to the North
-                    return 'left'
-                else:
-                    return 'right'
-            elif dx * heading[1] > 0: # Heading North destination West; Heading South destination East
-                return 'left'
-            else:
-                return 'right'
-
-        # Finally, check if destination is cardinally North or South of location
-        elif dy != 0:
-
-            if dy * heading[1] > 0:  # Heading the correct North or South direction
-                return 'forward'
-            elif dy * heading[1] < 0 and heading[1] < 0: # Heading North, destination South
-                if dx < 0: # Destination also to the West
-                    return 'left'
-                else:
-                    return 'right'
-            elif dy * heading[1] < 0 and heading[1] > 0: # Heading South, destination North
-                if dx > 0: # Destination also to the East
-                    return 'left'
-                else:
-                    return 'right'
-            elif dy * heading[0] > 0: # Heading West destination North; Heading East destination South
-                return 'right'
-            else:
-                return 'left'
\ No newline at end of file
+        state = self.env.agent_states[self.agent]
+        location = state['location']
+        return self.table[self.base - location[0] * self.x_stride - location[1] * self.y_stride + self.heading_index[state['heading']]]
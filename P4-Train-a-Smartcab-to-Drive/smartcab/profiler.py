@@ -0,0 +1,112 @@
+import csv
+import os
+import time
+
+# Phases timed by default: (name, owner, method), where owner is 'env', 'agent' or 'sim'
+default_phases = [
+    ('step', 'env', 'step'),
+    ('agent_update', 'agent', 'update'),
+    ('dummy_update', 'env', 'update_dummies'),
+    ('light_update', 'env', 'update_lights'),
+    ('sense', 'env', 'sense'),
+    ('act', 'env', 'act'),
+    ('render_text', 'sim', 'render_text'),
+    ('render', 'sim', 'render')
+]
+
+
+class StepProfiler(object):
+    """Accumulates wall time and call counts of the phases of a simulation step.
+
+    Each phase is timed by replacing a method on one object (the environment,
+    the primary agent or the simulator) with a timing wrapper, so nothing is
+    paid for when profiling is off. Times are exclusive: a phase called from
+    inside another, such as sense from agent_update, is not counted twice.
+    """
+
+    def __init__(self, phases=None):
+        self.phases = []
+        self.totals = {}      # phase -> [calls, seconds] over the whole run
+        self.current = {}     # phase -> [calls, seconds] over the current trial
+        self.trial_stats = [] # One row per finished trial
+        self.stack = []       # [phase, start, time spent in nested phases] of each running phase
+        self.clock = time.time
+        self.requested = phases if phases is not None else default_phases
+
+    def attach(self, sim):
+        """ Wrap the phase methods of the simulator 'sim', its environment and primary agent. """
+
+        owners = {'env': sim.env, 'agent': sim.env.primary_agent, 'sim': sim}
+        for name, owner, method in self.requested:
+            target = owners[owner]
+            if target is None or not hasattr(target, method):
+                continue
+            setattr(target, method, self.wrap(name, getattr(target, method)))
+            self.phases.append(name)
+            self.totals[name] = [0, 0.0]
+            self.current[name] = [0, 0.0]
+
+    def wrap(self, name, method):
+        """ Returns 'method' timed as phase 'name'. """
+
+        stack = self.stack
+        current = self.current
+        clock = self.clock
+
+        def timed(*args, **kwargs):
+            frame = [name, clock(), 0.0]
+            stack.append(frame)
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = clock() - frame[1]
+                stack.pop()
+                if stack:
+                    stack[-1][2] += elapsed
+                counts = current[name]
+                counts[0] += 1
+                counts[1] += elapsed - frame[2]
+        return timed
+
+    def end_trial(self, trial, testing):
+        """ Add the current trial to the run totals and start counting a new one. """
+
+        row = {'trial': trial, 'testing': testing}
+        for name in self.phases:
+            calls, seconds = self.current[name]
+            row[name + '_calls'] = calls
+            row[name + '_seconds'] = seconds
+            self.totals[name][0] += calls
+            self.totals[name][1] += seconds
+            self.current[name][0] = 0
+            self.current[name][1] = 0.0
+        self.trial_stats.append(row)
+        return row
+
+    def report(self):
+        """ Returns the end-of-run breakdown as a printable table. """
+
+        total = sum(seconds for calls, seconds in self.totals.itervalues())
+        lines = ["{:<14} {:>10} {:>12} {:>12} {:>7}".format("phase", "calls", "total (s)", "per call (us)", "share")]
+        for name in sorted(self.phases, key=lambda name: -self.totals[name][1]):
+            calls, seconds = self.totals[name]
+            lines.append("{:<14} {:>10} {:>12.3f} {:>12.2f} {:>6.1f}%".format(
+                name, calls, seconds, seconds * 1e6 / max(calls, 1), seconds * 100.0 / max(total, 1e-9)))
+        return "\n".join(lines)
+
+    def resume(self, filename, trials):
+        """ Keep the first 'trials' rows of a breakdown saved by an interrupted run, if there is one,
+            so that save() carries it on. """
+
+        if os.path.exists(filename):
+            with open(filename, 'rb') as f:
+                self.trial_stats = list(csv.DictReader(f))[:trials]
+
+    def save(self, filename):
+        """ Write the per-trial breakdown to a CSV file, one row per trial. """
+
+        fields = ['trial', 'testing'] + [name + suffix for name in self.phases for suffix in ('_calls', '_seconds')]
+        with open(filename, 'wb') as f:
+            writer = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(self.trial_stats)
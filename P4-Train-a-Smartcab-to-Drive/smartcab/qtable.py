@@ -0,0 +1,113 @@
+import itertools
+import numpy as np
+
+
+class StateEncoder(object):
+    """Maps every state of a fully enumerable state space to an integer index.
+
+    'features' is a list with the possible values of each element of the state
+    tuple, e.g. [waypoints, lights, oncoming, left] for LearningAgent.build_state.
+    """
+
+    def __init__(self, features):
+        self.states = list(itertools.product(*features))
+        self.index = dict((state, i) for i, state in enumerate(self.states))
+
+    def __len__(self):
+        return len(self.states)
+
+    def encode(self, state):
+        """ Returns the index of 'state'. """
+
+        return self.index[state]
+
+    def decode(self, i):
+        """ Returns the state with index 'i'. """
+
+        return self.states[i]
+
+
+class DenseQTable(object):
+    """Q-table stored as a NumPy array with one row per state and one column per action.
+
+    Only states that have been created count as part of the table, so that it
+    iterates and dumps like the dictionary Q-table of LearningAgent.
+    """
+
+    def __init__(self, encoder, actions):
+        self.encoder = encoder
+        self.actions = list(actions)
+        self.action_index = dict((action, j) for j, action in enumerate(self.actions))
+        self.values = np.zeros((len(encoder), len(self.actions)))
+        self.created = np.zeros(len(encoder), dtype=bool)
+
+    def __len__(self):
+        return int(self.created.sum())
+
+    def __contains__(self, state):
+        return bool(self.created[self.encoder.encode(state)])
+
+    def __iter__(self):
+        for i in np.flatnonzero(self.created):
+            yield self.encoder.decode(i)
+
+    def __getitem__(self, state):
+        """ Returns the Q-values of 'state' as a dictionary keyed by action. """
+
+        return dict(zip(self.actions, self.values[self.encoder.encode(state)].tolist()))
+
+    def iteritems(self):
+        """ Yields (state, {action: Q-value}) for each created state, converting all rows at once. """
+
+        created = np.flatnonzero(self.created)
+        for i, row in zip(created.tolist(), self.values[created].tolist()):
+            yield self.encoder.decode(i), dict(zip(self.actions, row))
+
+    def create(self, state):
+        """ Add 'state' to the table; its Q-values start at 0.0. """
+
+        self.created[self.encoder.encode(state)] = True
+
+    def set(self, state, values):
+        """ Create 'state' with the Q-values in 'values', a dictionary keyed by action. """
+
+        i = self.encoder.encode(state)
+        self.created[i] = True
+        for action, value in values.iteritems():
+            self.values[i, self.action_index[action]] = value
+
+    def get(self, state, action):
+        """ Returns the Q-value of ('state', 'action'). """
+
+        return self.values[self.encoder.encode(state), self.action_index[action]]
+
+    def add(self, state, action, amount):
+        """ Add 'amount' to the Q-value of ('state', 'action'). """
+
+        self.values[self.encoder.encode(state), self.action_index[action]] += amount
+
+    def update_batch(self, states, actions, rewards, next_states, alpha, gamma):
+        """ Q-learning updates for a batch of encoded transitions at once. A next state of -1
+            ends the trial. Repeated (state, action) pairs each add their own update. """
+
+        future = np.where(next_states >= 0, self.values[next_states].max(axis=1), 0.0)
+        targets = rewards + gamma * future
+        np.add.at(self.values, (states, actions), alpha * (targets - self.values[states, actions]))
+
+    def max(self, state):
+        """ Returns the maximum Q-value of 'state'. """
+
+        return self.values[self.encoder.encode(state)].max()
+
+    def best_actions(self, state):
+        """ Returns every action that ties for the maximum Q-value of 'state'. """
+
+        row = self.values[self.encoder.encode(state)]
+        return [self.actions[j] for j in np.flatnonzero(row == row.max())]
+
+    def update(self, state, action, reward, alpha):
+        """ Move the Q-value of ('state', 'action') towards 'reward' with learning rate 'alpha'. """
+
+        i = self.encoder.encode(state)
+        j = self.action_index[action]
+        self.values[i, j] += alpha * (reward - self.values[i, j])
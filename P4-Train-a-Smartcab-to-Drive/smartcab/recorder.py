@@ -0,0 +1,130 @@
+import struct
+from environment import Environment
+from qtable import StateEncoder
+
+# Each record starts with its kind, followed by a fixed layout for that kind
+TRIAL, STEP = 0, 1
+kinds = struct.Struct('<B')
+trial_record = struct.Struct('<IiBhhbhhh')    # trial, primary agent, testing, start x, y, heading, destination x, y, deadline
+step_record = struct.Struct('<Iiihbdbhhbh')   # trial, t, agent, state, action, reward, violation, x, y, heading, deadline
+
+action_codes = dict((action, i) for i, action in enumerate(Environment.valid_actions))
+heading_codes = dict((heading, i) for i, heading in enumerate(Environment.valid_headings))
+
+# States built by LearningAgent.build_state are stored as their index in this encoder
+state_encoder = StateEncoder([Environment.valid_actions, ['green', 'red'], Environment.valid_actions, Environment.valid_actions])
+
+
+class TrajectoryRecorder(object):
+    """Streams every step of the primary agent, and optionally the dummies, to a binary log.
+
+    Attach it with env.recorder = TrajectoryRecorder(filename). Records are fixed-size
+    structs appended to the file as the simulation runs, so nothing is kept in memory.
+    Dummies are recorded through Environment.act, which VectorizedEnvironment bypasses.
+    """
+
+    def __init__(self, filename, record_dummies=False):
+        self.filename = filename
+        self.record_dummies = record_dummies
+        self.file = open(filename, 'wb')
+        self.trial = 0
+
+    def start_trial(self, env, testing):
+        """ Called by Environment.reset once every agent has been placed. """
+
+        self.trial += 1
+        state = env.agent_states[env.primary_agent]
+        self.file.write(kinds.pack(TRIAL) + trial_record.pack(
+            self.trial, env.agent_order[env.primary_agent], testing, state['location'][0], state['location'][1],
+            heading_codes[state['heading']], state['destination'][0], state['destination'][1], state['deadline']))
+
+    def record(self, env, agent, action, reward, violation):
+        """ Called by Environment.act after 'agent' has acted. """
+
+        if agent is not env.primary_agent and not self.record_dummies:
+            return
+
+        state = env.agent_states[agent]
+        encoded = state_encoder.index.get(agent.get_state(), -1)
+        deadline = state['deadline'] if state['deadline'] is not None else 0
+        self.file.write(kinds.pack(STEP) + step_record.pack(
+            self.trial, env.t, env.agent_order[agent], encoded, action_codes[action], reward, violation,
+            state['location'][0], state['location'][1], heading_codes[state['heading']], deadline))
+
+    def close(self):
+        self.file.close()
+
+
+class TrajectoryReplay(object):
+    """Reads a log written by TrajectoryRecorder to re-render or re-score its trials
+    without simulating the environment again."""
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def records(self):
+        """ Yields every record in the log as a dictionary, streaming from disk. """
+
+        with open(self.filename, 'rb') as f:
+            while True:
+                kind = f.read(kinds.size)
+                if not kind:
+                    break
+                if kinds.unpack(kind)[0] == TRIAL:
+                    trial, agent, testing, x, y, heading, dx, dy, deadline = trial_record.unpack(f.read(trial_record.size))
+                    yield {'kind': TRIAL, 'trial': trial, 'agent': agent, 'testing': bool(testing), 'start': (x, y),
+                           'heading': Environment.valid_headings[heading], 'destination': (dx, dy), 'deadline': deadline}
+                else:
+                    trial, t, agent, state, action, reward, violation, x, y, heading, deadline = step_record.unpack(f.read(step_record.size))
+                    yield {'kind': STEP, 'trial': trial, 't': t, 'agent': agent,
+                           'state': state_encoder.decode(state) if state >= 0 else None,
+                           'action': Environment.valid_actions[action], 'reward': reward, 'violation': violation,
+                           'location': (x, y), 'heading': Environment.valid_headings[heading], 'deadline': deadline}
+
+    def trials(self):
+        """ Returns the set-up of every trial in the log. """
+
+        return [record for record in self.records() if record['kind'] == TRIAL]
+
+    def steps(self, trial, agent=None):
+        """ Returns the steps of 'agent' in 'trial'; by default those of the primary agent. """
+
+        steps = []
+        for record in self.records():
+            if record['trial'] != trial:
+                continue
+            if record['kind'] == TRIAL:
+                agent = record['agent'] if agent is None else agent
+            elif record['agent'] == agent:
+                steps.append(record)
+        return steps
+
+    def score(self, trial):
+        """ Recompute the trial data of Environment.trial_data for 'trial' from its steps. """
+
+        header = [record for record in self.trials() if record['trial'] == trial][0]
+        scored = {
+            'testing': header['testing'],
+            'initial_deadline': header['deadline'],
+            'final_deadline': header['deadline'],
+            'net_reward': 0.0,
+            'actions': {0: 0, 1: 0, 2: 0, 3: 0, 4: 0},
+            'success': 0
+        }
+        for step in self.steps(trial):
+            scored['final_deadline'] = step['deadline'] - 1
+            scored['net_reward'] += step['reward']
+            scored['actions'][step['violation']] += 1
+            if step['location'] == header['destination'] and step['deadline'] >= 0:
+                scored['success'] = 1
+        return scored
+
+    def render(self, trial):
+        """ Print the steps of 'trial' to the terminal. """
+
+        header = [record for record in self.trials() if record['trial'] == trial][0]
+        print "Trial {} ({}): start = {}, destination = {}, deadline = {}".format(
+            trial, "testing" if header['testing'] else "training", header['start'], header['destination'], header['deadline'])
+        for step in self.steps(trial):
+            print "t = {:>3}: state {}, action {}, violation {}, reward {:.2f} -> location {}, heading {}".format(
+                step['t'], step['state'], step['action'], step['violation'], step['reward'], step['location'], step['heading'])
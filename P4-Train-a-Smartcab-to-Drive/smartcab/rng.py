@@ -0,0 +1,16 @@
+import random
+import hashlib
+
+
+def stream(seed, name):
+    """ Returns the random number generator of the component 'name'.
+
+        With seed None this is the random module itself, so all components share
+        the global stream controlled by random.seed. Otherwise each component gets
+        its own random.Random, seeded from a hash of (seed, name): streams of
+        different components do not overlap, and a seed gives the same sequences
+        in every process. """
+
+    if seed is None:
+        return random
+    return random.Random(int(hashlib.md5("{}:{}".format(seed, name)).hexdigest(), 16))
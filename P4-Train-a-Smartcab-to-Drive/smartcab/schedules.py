@@ -0,0 +1,181 @@
+import json
+import math
+
+# Minimum number of training trials before Simulator.run may switch to testing
+min_training_trials = 20
+
+
+class Schedule(object):
+    """An epsilon decay schedule for LearningAgent.
+
+    A schedule is called at the start of every training trial with the current
+    epsilon, alpha and trial count t (0 for the first trial), and returns the new
+    epsilon. precompute() returns the epsilons of many trials at once as a NumPy
+    array; by default it applies the schedule trial by trial, and schedules with
+    a closed form override it to compute the whole array in one go. Only
+    precompute() needs NumPy.
+    """
+
+    def __call__(self, epsilon, alpha, t):
+        """ Returns the epsilon of training trial 't'. Abstract: every schedule defines it. """
+
+        raise NotImplementedError
+
+    def observe(self, net_reward):
+        """ Called with the net reward of each finished training trial. """
+
+        pass
+
+    def precompute(self, epsilon, alpha, n):
+        """ Returns the epsilon of each of the first 'n' training trials, starting from 'epsilon'. """
+
+        import numpy as np
+        epsilons = np.empty(n)
+        for t in xrange(n):
+            epsilon = self(epsilon, alpha, t)
+            epsilons[t] = epsilon
+        return epsilons
+
+
+class Linear(Schedule):
+    """ epsilon - rate, every trial. """
+
+    def __init__(self, rate=0.05):
+        self.rate = rate
+
+    def __call__(self, epsilon, alpha, t):
+        return epsilon - self.rate
+
+    def precompute(self, epsilon, alpha, n):
+        import numpy as np
+        return epsilon - self.rate * np.arange(1, n + 1)
+
+
+class Power(Schedule):
+    """ alpha ** t """
+
+    def __call__(self, epsilon, alpha, t):
+        return alpha ** t
+
+    def precompute(self, epsilon, alpha, n):
+        import numpy as np
+        return alpha ** np.arange(n, dtype=float)
+
+
+class InversePower(Schedule):
+    """ 1 / (t + 1) ** power """
+
+    def __init__(self, power=2):
+        self.power = power
+
+    def __call__(self, epsilon, alpha, t):
+        return 1.0 / (t + 1) ** self.power
+
+    def precompute(self, epsilon, alpha, n):
+        import numpy as np
+        return 1.0 / np.arange(1, n + 1, dtype=float) ** self.power
+
+
+class Exponential(Schedule):
+    """ exp(-alpha * t) """
+
+    def __call__(self, epsilon, alpha, t):
+        return math.exp(-alpha * t)
+
+    def precompute(self, epsilon, alpha, n):
+        import numpy as np
+        return np.exp(-alpha * np.arange(n, dtype=float))
+
+
+class Cosine(Schedule):
+    """ |cos(alpha * t)| """
+
+    def __call__(self, epsilon, alpha, t):
+        return math.fabs(math.cos(alpha * t))
+
+    def precompute(self, epsilon, alpha, n):
+        import numpy as np
+        return np.abs(np.cos(alpha * np.arange(n, dtype=float)))
+
+
+class Step(Schedule):
+    """ epsilon * factor, once every 'every' trials. """
+
+    def __init__(self, factor=0.5, every=10):
+        self.factor = factor
+        self.every = every
+
+    def __call__(self, epsilon, alpha, t):
+        if t > 0 and t % self.every == 0:
+            return epsilon * self.factor
+        return epsilon
+
+    def precompute(self, epsilon, alpha, n):
+        import numpy as np
+        return epsilon * self.factor ** (np.arange(n) // self.every)
+
+
+class Adaptive(Schedule):
+    """ epsilon * (1 - rate) after a trial that earned at least the average net reward
+        of the trials before it, and epsilon * slow otherwise. Depends on the rewards
+        earned, so it cannot be precomputed. """
+
+    def __init__(self, rate=0.1, slow=0.99):
+        self.rate = rate
+        self.slow = slow
+        self.rewards = []
+
+    def observe(self, net_reward):
+        self.rewards.append(net_reward)
+
+    def __call__(self, epsilon, alpha, t):
+        if len(self.rewards) < 2:
+            return epsilon
+        earlier = self.rewards[:-1]
+        if self.rewards[-1] >= sum(earlier) / len(earlier):
+            return epsilon * (1 - self.rate)
+        return epsilon * self.slow
+
+    def precompute(self, epsilon, alpha, n):
+        raise ValueError("The adaptive schedule depends on the rewards earned and cannot be precomputed.")
+
+
+# Schedules by name, for LearningAgent(decay=...)
+schedules = {
+    'linear': Linear,
+    'power': Power,
+    'inverse_square': InversePower,
+    'inverse_power': InversePower,
+    'exponential': Exponential,
+    'cosine': Cosine,
+    'step': Step,
+    'adaptive': Adaptive
+}
+
+
+def make_schedule(spec):
+    """ Returns the schedule described by 'spec': a Schedule, the name of one in 'schedules',
+        a dictionary with its 'name' and parameters, or a JSON file holding such a dictionary. """
+
+    if isinstance(spec, Schedule):
+        return spec
+    if isinstance(spec, basestring) and spec.endswith('.json'):
+        with open(spec) as f:
+            spec = json.load(f)
+    if isinstance(spec, dict):
+        parameters = dict((str(key), value) for key, value in spec.iteritems() if key != 'name')
+        return schedules[spec['name']](**parameters)
+    return schedules[spec]()
+
+
+def predict_training_trials(spec, epsilon, alpha, tolerance, max_trials=10000):
+    """ Returns the number of training trials Simulator.run will simulate for a learning agent
+        with this schedule before switching to testing, or None if epsilon does not fall below
+        'tolerance' within 'max_trials' trials. """
+
+    import numpy as np
+    epsilons = make_schedule(spec).precompute(epsilon, alpha, max_trials)
+    below = np.flatnonzero(epsilons[min_training_trials - 1:] < tolerance)
+    if len(below) == 0:
+        return None
+    return int(below[0]) + min_training_trials
@@ -10,6 +10,8 @@ import time
 import random
 import importlib
 import csv
+import pickle
+from stats import TrialStats, log_row_metrics
 
 class Simulator(object):
     """Simulates agents in a dynamic smartcab environment.
@@ -34,7 +36,7 @@ class Simulator(object):
         'gray'    : (155, 155, 155)
     }
 
-    def __init__(self, env, size=None, update_delay=2.0, display=True, log_metrics=False, optimized=False):
+    def __init__(self, env, size=None, update_delay=2.0, display=True, log_metrics=False, optimized=False, fast_forward=False, record_trials=False, log_format='csv', profile=False, fps=None, speed=None, capture=None, checkpoint=None, checkpoint_every=10, background_log=False, monitor_port=None):
         self.env = env
         self.size = size if size is not None else ((self.env.grid_size[0] + 1) * self.env.block_size, (self.env.grid_size[1] + 2) * self.env.block_size)
         self.width, self.height = self.size
@@ -52,8 +54,43 @@ class Simulator(object):
         self.last_updated = 0.0
         self.update_delay = update_delay  # duration between each step (in seconds)
 
+        # Frame-rate-decoupled display: render at most 'fps' frames per second, skipping frames in between,
+        # while the environment steps as fast as possible or at 'speed' times the update_delay pace
+        if speed is not None and fps is None:
+            raise ValueError("Simulator: speed only applies with fps; got speed={!r} without fps".format(speed))
+        self.fps = fps
+        self.speed = speed
+        self.frames_rendered = 0
+
+        # Fast-forward mode steps the environment back-to-back, without the GUI or per-step output
+        self.fast_forward = fast_forward
+        if self.fast_forward:
+            display = False
+            self.env.quiet = True
+
+        # With a frame rate, the per-step banner of Environment.step is printed only for rendered frames
+        self.frame_banner = self.fps is not None and not self.env.quiet
+        if self.frame_banner:
+            self.env.quiet = True
+
+        # Throughput counters, updated as the simulation runs
+        self.trials_run = 0
+        self.steps_run = 0
+        self.run_time = 0.0
+        self.run_start = None
+        self.current_trial = (None, False)  # (trial, testing) of the trial being simulated
+
+        # Serve the progress of each run as JSON on this local port (see monitor.py)
+        self.monitor_port = monitor_port
+        self.monitor = None
+
+        # Frames of selected trials can be saved to image files (see capture.py)
+        self.capture = capture
+
         self.display = display
-        if self.display:
+        if self.display or self.capture is not None:
+            if not self.display:
+                os.environ['SDL_VIDEODRIVER'] = 'dummy'  # Render off-screen, with no window
             try:
                 self.pygame = importlib.import_module('pygame')
                 self.pygame.init()
@@ -74,18 +111,58 @@ class Simulator(object):
                         agent._sprite = self.pygame.transform.smoothscale(self.pygame.image.load(os.path.join("images", "car-{}.png".format(agent.color))), self.agent_sprite_size)
                     agent._sprite_size = (agent._sprite.get_width(), agent._sprite.get_height())
 
-                self.font = self.pygame.font.Font(None, 20)
+                    # Rotate each sprite once for each heading, instead of on every frame
+                    agent._sprites = dict((heading, agent._sprite if heading == (1, 0) else self.pygame.transform.rotate(agent._sprite, 180 if heading[0] == -1 else heading[1] * -90))
+                                          for heading in self.env.valid_headings)
+
+                self.fonts = dict((size, self.pygame.font.Font(None, size)) for size in (20, 22, 30, 40, 50))
+                self.font = self.fonts[20]
                 self.paused = False
+
+                # Rendering state: the cached scene, and what was drawn where in the last frame
+                self.scene = None
+                self.full_redraw = True
+                self.agent_places = {}
+                self.agent_rects = {}
+                self.text_rects = []
+                self.logo_rect = None
             except ImportError as e:
                 self.display = False
+                self.capture = None
                 print "Simulator.__init__(): Unable to import pygame; display disabled.\n{}: {}".format(e.__class__.__name__, e)
             except Exception as e:
                 self.display = False
+                self.capture = None
                 print "Simulator.__init__(): Error initializing GUI objects; display disabled.\n{}: {}".format(e.__class__.__name__, e)
 
+        # Save the learning agent to 'checkpoint' during training, and resume from it if it exists
+        self.checkpoint = checkpoint
+        self.checkpoint_every = checkpoint_every
+        resuming = self.checkpoint is not None and os.path.exists(self.checkpoint) and \
+            self.env.primary_agent is not None and self.env.primary_agent.learning
+
         # Setup metrics to report
         self.log_metrics = log_metrics
         self.optimized = optimized
+        self.log_format = log_format  # 'csv' for one row per trial, 'npz' for typed columns saved in bulk
+        self.background_log = background_log  # If log rows are written from a background thread (see background.py)
+
+        # Keep a copy of each trial's metrics in memory, as they would be logged
+        self.record_trials = record_trials
+        self.trial_log = []
+
+        # Rolling statistics of the trials, updated as they finish (see stats.py)
+        self.stats = TrialStats(keep_columns=self.log_metrics)  # Every trial is kept only to be saved with the log
+
+        # Trials kept in the log of an interrupted run, replayed into self.stats on resume
+        self.resumed_trials = []
+
+        # Optionally time each phase of a step (see profiler.py)
+        self.profiler = None
+        if profile:
+            from profiler import StepProfiler
+            self.profiler = StepProfiler()
+            self.profiler.attach(self)
         
         if self.log_metrics:
             a = self.env.primary_agent
@@ -104,9 +181,39 @@ class Simulator(object):
                 self.log_filename = os.path.join("logs", "sim_no-learning.csv")
             
             self.log_fields = ['trial', 'testing', 'parameters', 'initial_deadline', 'final_deadline', 'net_reward', 'actions', 'success']
-            self.log_file = open(self.log_filename, 'wb')
-            self.log_writer = csv.DictWriter(self.log_file, fieldnames=self.log_fields)
-            self.log_writer.writeheader()
+            # Trials of the interrupted run to keep in its log: the ones logged after
+            # the checkpoint was saved are simulated again, and logged again, on resume
+            if resuming:
+                with open(self.checkpoint, 'rb') as f:
+                    kept_trials = pickle.load(f)['trials']
+
+            if self.log_format == 'npz':
+                from metrics import TrialMetrics, column_metrics
+                self.log_filename = os.path.splitext(self.log_filename)[0] + ".npz"
+                self.log_writer = TrialMetrics(self.log_filename)
+                if resuming and os.path.exists(self.log_filename):
+                    self.log_writer.resume(kept_trials)
+                    self.resumed_trials = list(column_metrics(self.log_writer.columns()))
+            elif resuming and os.path.exists(self.log_filename):
+                # Carry on the log of the interrupted run, up to the checkpoint
+                with open(self.log_filename, 'rb') as f:
+                    rows = list(csv.reader(f))
+                self.log_file = open(self.log_filename, 'wb')
+                csv.writer(self.log_file).writerows(rows[:kept_trials + 1])  # Header and kept trials
+                self.resumed_trials = [log_row_metrics(dict(zip(rows[0], row))) for row in rows[1:kept_trials + 1]]
+                self.log_writer = csv.DictWriter(self.log_file, fieldnames=self.log_fields)
+            else:
+                self.log_file = open(self.log_filename, 'wb')
+                self.log_writer = csv.DictWriter(self.log_file, fieldnames=self.log_fields)
+                self.log_writer.writeheader()
+
+            if self.background_log:
+                from background import BackgroundWriter
+                self.log_writer = BackgroundWriter(self.log_writer, self.log_file if self.log_format != 'npz' else None)
+
+            # Carry on the per-trial profile of the interrupted run, up to the checkpoint
+            if resuming and self.profiler is not None:
+                self.profiler.resume(os.path.splitext(self.log_filename)[0] + "_profile.csv", kept_trials)
 
     def run(self, tolerance=0.05, n_test=0):
         """ Run a simulation of the environment. 
@@ -125,83 +232,175 @@ class Simulator(object):
         testing = False
         trial = 1
 
-        while True:
+        # Resume training, or go straight to testing, from a checkpoint
+        if self.checkpoint is not None and a.learning and os.path.exists(self.checkpoint):
+            total_trials = a.load_checkpoint(self.checkpoint) + 1
+            trial = total_trials
+            print "Simulator.run(): Resuming from {} after {} trials.".format(self.checkpoint, total_trials - 1)
+
+        self.trials_run = 0
+        self.steps_run = 0
+        self.frames_rendered = 0
+        self.trial_log = []
+
+        # Statistics carry on from the trials kept in the log of a resumed run
+        self.stats = TrialStats(self.stats.window, self.stats.keep_columns)
+        if total_trials > 1:
+            for metrics in self.resumed_trials:
+                self.stats.update(metrics)
+        self.run_start = time.time()
+
+        if self.monitor_port is not None:
+            from monitor import StatusServer
+            self.monitor = StatusServer(self, self.monitor_port)
+            print "Simulator.run(): Serving status at http://{}:{}/status".format(*self.monitor.address)
+
+        # Time between steps and between frames (in seconds)
+        if self.fps is None:
+            step_interval = self.update_delay
+        else:
+            step_interval = self.update_delay / self.speed if self.speed else 0.0
+            frame_interval = 1.0 / self.fps
+
+        # Close the status server and the logs even if the run is interrupted,
+        # so the port is released and every queued log row is written
+        try:
+            while True:
 
-            # Flip testing switch
-            if not testing:
-                if total_trials > 20: # Must complete minimum 20 training trials
-                    if a.learning:
-                        if a.epsilon < tolerance: # assumes epsilon decays to 0
+                # Flip testing switch
+                if not testing:
+                    if total_trials > 20: # Must complete minimum 20 training trials
+                        if a.learning:
+                            if a.epsilon < tolerance: # assumes epsilon decays to 0
+                                testing = True
+                                trial = 1
+
+                                # Save the trained agent, so that testing can be rerun without training
+                                if self.checkpoint is not None:
+                                    a.save_checkpoint(self.checkpoint, total_trials - 1)
+                        else:
                             testing = True
                             trial = 1
-                    else:
-                        testing = True
-                        trial = 1
                         
-            # Break if we've reached the limit of testing trials
-            else:
-                if trial > n_test:
-                    break
-
-            # Pretty print to terminal
-            print 
-            print "/-------------------------"
-            if testing:
-                print "| Testing trial {}".format(trial)
-            else:
-                print "| Training trial {}".format(trial)
-
-            print "\-------------------------"
-            print 
-
-            self.env.reset(testing)
-            self.current_time = 0.0
-            self.last_updated = 0.0
-            self.start_time = time.time()
-            while True:
-                try:
-                    # Update current time
-                    self.current_time = time.time() - self.start_time
-
-                    # Handle GUI events
-                    if self.display:
-                        for event in self.pygame.event.get():
-                            if event.type == self.pygame.QUIT:
-                                self.quit = True
-                            elif event.type == self.pygame.KEYDOWN:
-                                if event.key == 27:  # Esc
-                                    self.quit = True
-                                elif event.unicode == u' ':
-                                    self.paused = True
-
-                        if self.paused:
-                            self.pause()
-
-                    # Update environment
-                    if self.current_time - self.last_updated >= self.update_delay:
-                        self.env.step()
-                        self.last_updated = self.current_time
-                    
-                    # Render text
-                    self.render_text(trial, testing)
-
-                    # Render GUI and sleep
-                    if self.display:
-                        self.render(trial, testing)
-                        self.pygame.time.wait(self.frame_delay)
-
-                except KeyboardInterrupt:
-                    self.quit = True
-                finally:
-                    if self.quit or self.env.done:
+                # Break if we've reached the limit of testing trials
+                else:
+                    if trial > n_test:
                         break
 
-            if self.quit:
-                break
+                # Pretty print to terminal
+                if not self.fast_forward:
+                    print 
+                    print "/-------------------------"
+                    if testing:
+                        print "| Testing trial {}".format(trial)
+                    else:
+                        print "| Training trial {}".format(trial)
+
+                    print "\-------------------------"
+                    print 
+
+                self.env.reset(testing)
+                self.current_trial = (trial, testing)
+                self.current_time = 0.0
+                self.last_updated = 0.0
+                self.last_rendered = None
+                self.start_time = time.time()
+
+                # Save the starting frame of a captured trial
+                capturing = self.capture is not None and self.capture.start_trial(total_trials, trial, testing)
+                if capturing:
+                    self.capture_frame(trial, testing)
+
+                # Step as fast as possible, without polling the clock
+                if self.fast_forward:
+                    try:
+                        while not self.env.done:
+                            self.env.step()
+                            self.steps_run += 1
+                            if capturing:
+                                self.capture_frame(trial, testing)
+                    except KeyboardInterrupt:
+                        self.quit = True
+                else:
+                    while True:
+                        try:
+                            # Update current time
+                            self.current_time = time.time() - self.start_time
+
+                            # Handle GUI events
+                            if self.display:
+                                for event in self.pygame.event.get():
+                                    if event.type == self.pygame.QUIT:
+                                        self.quit = True
+                                    elif event.type == self.pygame.KEYDOWN:
+                                        if event.key == 27:  # Esc
+                                            self.quit = True
+                                        elif self.paused:
+                                            # Only the display was paused: resume it with a full redraw
+                                            self.paused = False
+                                            self.full_redraw = True
+                                        elif event.unicode == u' ':
+                                            self.paused = True
+                                            if self.fps is not None:
+                                                self.show_pause_text()
+
+                                # With a frame rate, pausing freezes the display while the simulation keeps stepping
+                                if self.paused and self.fps is None:
+                                    self.pause()
+
+                            # Update environment
+                            stepped = False
+                            if self.current_time - self.last_updated >= step_interval:
+                                self.env.step()
+                                self.steps_run += 1
+                                self.last_updated = self.current_time
+                                stepped = True
+                                if capturing:
+                                    self.capture_frame(trial, testing)
+
+                            if self.fps is None:
+                                # Render text
+                                self.render_text(trial, testing)
+
+                                # Render GUI and sleep
+                                if self.display:
+                                    self.render(trial, testing)
+                                    self.pygame.time.wait(self.frame_delay)
+                                self.frames_rendered += 1
+
+                            # Render only when a frame is due, skipping the steps in between,
+                            # and always render the step that ends the trial
+                            elif self.env.done or self.last_rendered is None or self.current_time - self.last_rendered >= frame_interval:
+                                if self.frame_banner and self.env.t > 0:
+                                    print ""
+                                    print "/-------------------"
+                                    print "| Step {} Results".format(self.env.t - 1)
+                                    print "\-------------------"
+                                    print ""
+                                self.render_text(trial, testing)
+                                if self.display and not self.paused:
+                                    self.render(trial, testing)
+                                self.frames_rendered += 1
+                                self.last_rendered = self.current_time
+
+                            # Nothing due yet: yield instead of spinning
+                            elif not stepped:
+                                time.sleep(0.001)
+
+                        except KeyboardInterrupt:
+                            self.quit = True
+                        finally:
+                            if self.quit or self.env.done:
+                                break
+
+                if capturing:
+                    self.capture.finish_trial(self.env.success)
+
+                if self.quit:
+                    break
 
-            # Collect metrics from trial
-            if self.log_metrics:
-                self.log_writer.writerow({
+                # Collect metrics from trial
+                metrics = {
                     'trial': trial,
                     'testing': self.env.trial_data['testing'],
                     'parameters': self.env.trial_data['parameters'],
@@ -210,19 +409,55 @@ class Simulator(object):
                     'net_reward': self.env.trial_data['net_reward'],
                     'actions': self.env.trial_data['actions'],
                     'success': self.env.trial_data['success']
-                })
+                }
+                if self.log_metrics:
+                    self.log_writer.writerow(metrics)
+                if self.record_trials:
+                    self.trial_log.append(metrics)
+                self.stats.update(metrics)
+                if self.monitor is not None:
+                    self.monitor.publish(self.stats.summary())
+
+                if self.profiler is not None:
+                    self.profiler.end_trial(trial, testing)
+
+                # Trial finished
+                if not self.fast_forward:
+                    if self.env.success == True:
+                        print "\nTrial Completed!"
+                        print "Agent reached the destination."
+                    else:
+                        print "\nTrial Aborted!"
+                        print "Agent did not reach the destination."
 
-            # Trial finished
-            if self.env.success == True:
-                print "\nTrial Completed!"
-                print "Agent reached the destination."
-            else:
-                print "\nTrial Aborted!"
-                print "Agent did not reach the destination."
+                # Save the learning agent every few training trials
+                if self.checkpoint is not None and a.learning and not testing and total_trials % self.checkpoint_every == 0:
+                    a.save_checkpoint(self.checkpoint, total_trials)
+
+                # Increment
+                total_trials = total_trials + 1
+                trial = trial + 1
+                self.trials_run += 1
+
+            # Learn the transitions still pending, so that the Q-table below is complete
+            if a.learning:
+                a.flush()
+        finally:
+            self.run_time = time.time() - self.run_start
+
+            if self.monitor is not None:
+                self.monitor.close()
+                self.monitor = None
+
+            if self.log_metrics:
+                if self.background_log or self.log_format == 'npz':
+                    self.log_writer.close()
+                else:
+                    self.log_file.close()
 
-            # Increment
-            total_trials = total_trials + 1
-            trial = trial + 1
+                # Save the per-trial breakdown next to the metrics log
+                if self.profiler is not None:
+                    self.profiler.save(os.path.splitext(self.log_filename)[0] + "_profile.csv")
 
         # Clean up
         if self.log_metrics:
@@ -234,19 +469,33 @@ class Simulator(object):
                 f.write("| State-action rewards from Q-Learning\n")
                 f.write("\-----------------------------------------\n\n")
 
-                for state in a.Q:
+                for state, rewards in a.Q.iteritems():
                     f.write("{}\n".format(state))
-                    for action, reward in a.Q[state].iteritems():
+                    for action, reward in rewards.iteritems():
                         f.write(" -- {} : {:.2f}\n".format(action, reward))
                     f.write("\n")  
                 self.table_file.close()
 
-            self.log_file.close()
+            # Save the rolling statistics for visuals.plot_trials
+            self.stats.save(os.path.splitext(self.log_filename)[0] + "_stats.json")
 
         print "\nSimulation ended. . . "
 
+        # Report where the time went
+        if self.profiler is not None:
+            print self.profiler.report()
+
+        # Report throughput when running headless
+        if self.fast_forward:
+            print "{} trials ({} steps) in {:.2f} seconds: {:.1f} trials/sec, {:.1f} steps/sec".format(
+                self.trials_run, self.steps_run, self.run_time,
+                self.trials_run / max(self.run_time, 1e-9), self.steps_run / max(self.run_time, 1e-9))
+
+        if self.fps is not None:
+            print "{} frames rendered for {} steps in {:.2f} seconds".format(self.frames_rendered, self.steps_run, self.run_time)
+
         # Report final metrics
-        if self.display:
+        if self.display or self.capture is not None:
             self.pygame.display.quit()  # shut down pygame
 
     def render_text(self, trial, testing=False):
@@ -300,77 +549,165 @@ class Simulator(object):
                 print "Agent not set to learn."
 
                 
-    def render(self, trial, testing=False):
-        """ This is the GUI render display of the simulation. 
-            Supplementary trial data can be found from render_text. """
-        
-        # Reset the screen.
-        self.screen.fill(self.bg_color)
+    def build_scene(self):
+        """ Draws the static road network once, to an off-screen surface that every frame starts from.
+            Traffic lights are drawn onto the same surface as they change. """
 
-        # Draw elements
-        # * Static elements
+        scene = self.pygame.Surface(self.size)
+        scene.fill(self.bg_color)
 
         # Boundary
-        self.pygame.draw.rect(self.screen, self.boundary, ((self.env.bounds[0] - self.env.hang)*self.env.block_size, (self.env.bounds[1]-self.env.hang)*self.env.block_size, (self.env.bounds[2] + self.env.hang/3)*self.env.block_size, (self.env.bounds[3] - 1 + self.env.hang/3)*self.env.block_size), 4)
-        
+        self.pygame.draw.rect(scene, self.boundary, ((self.env.bounds[0] - self.env.hang)*self.env.block_size, (self.env.bounds[1]-self.env.hang)*self.env.block_size, (self.env.bounds[2] + self.env.hang/3)*self.env.block_size, (self.env.bounds[3] - 1 + self.env.hang/3)*self.env.block_size), 4)
+
         for road in self.env.roads:
             # Road
-            self.pygame.draw.line(self.screen, self.road_color, (road[0][0] * self.env.block_size, road[0][1] * self.env.block_size), (road[1][0] * self.env.block_size, road[1][1] * self.env.block_size), self.road_width)
+            self.pygame.draw.line(scene, self.road_color, (road[0][0] * self.env.block_size, road[0][1] * self.env.block_size), (road[1][0] * self.env.block_size, road[1][1] * self.env.block_size), self.road_width)
             # Center line
-            self.pygame.draw.line(self.screen, self.line_color, (road[0][0] * self.env.block_size, road[0][1] * self.env.block_size), (road[1][0] * self.env.block_size, road[1][1] * self.env.block_size), 2)
-        
-        for intersection, traffic_light in self.env.intersections.iteritems():
-            self.pygame.draw.circle(self.screen, self.road_color, (intersection[0] * self.env.block_size, intersection[1] * self.env.block_size), self.road_width/2)
-            
-            if traffic_light.state: # North-South is open
-                self.screen.blit(self._ns,
-                    self.pygame.rect.Rect(intersection[0]*self.env.block_size - self.road_width/2, intersection[1]*self.env.block_size - self.road_width/2, intersection[0]*self.env.block_size + self.road_width, intersection[1]*self.env.block_size + self.road_width/2))
-                self.pygame.draw.line(self.screen, self.stop_color, (intersection[0] * self.env.block_size - self.road_width/2, intersection[1] * self.env.block_size - self.road_width/2), (intersection[0] * self.env.block_size - self.road_width/2, intersection[1] * self.env.block_size + self.road_width/2), 2)
-                self.pygame.draw.line(self.screen, self.stop_color, (intersection[0] * self.env.block_size + self.road_width/2 + 1, intersection[1] * self.env.block_size - self.road_width/2), (intersection[0] * self.env.block_size + self.road_width/2 + 1, intersection[1] * self.env.block_size + self.road_width/2), 2)            
-            else:
-                self.screen.blit(self._ew,
-                    self.pygame.rect.Rect(intersection[0]*self.env.block_size - self.road_width/2, intersection[1]*self.env.block_size - self.road_width/2, intersection[0]*self.env.block_size + self.road_width, intersection[1]*self.env.block_size + self.road_width/2))
-                self.pygame.draw.line(self.screen, self.stop_color, (intersection[0] * self.env.block_size - self.road_width/2, intersection[1] * self.env.block_size - self.road_width/2), (intersection[0] * self.env.block_size + self.road_width/2, intersection[1] * self.env.block_size - self.road_width/2), 2)
-                self.pygame.draw.line(self.screen, self.stop_color, (intersection[0] * self.env.block_size + self.road_width/2, intersection[1] * self.env.block_size + self.road_width/2 + 1), (intersection[0] * self.env.block_size - self.road_width/2, intersection[1] * self.env.block_size + self.road_width/2 + 1), 2)            
-            
-        # * Dynamic elements
-        self.font = self.pygame.font.Font(None, 20)
-        for agent, state in self.env.agent_states.iteritems():
-            # Compute precise agent location here (back from the intersection some)
-            agent_offset = (2 * state['heading'][0] * self.agent_circle_radius + self.agent_circle_radius * state['heading'][1] * 0.5, \
-                            2 * state['heading'][1] * self.agent_circle_radius - self.agent_circle_radius * state['heading'][0] * 0.5)
+            self.pygame.draw.line(scene, self.line_color, (road[0][0] * self.env.block_size, road[0][1] * self.env.block_size), (road[1][0] * self.env.block_size, road[1][1] * self.env.block_size), 2)
+
+        self.background = scene.copy()  # Without traffic lights, to clear a light before redrawing it
+        self.light_states = {}
+        return scene
 
+    def draw_light(self, intersection, state):
+        """ Draws the traffic light at 'intersection' onto the scene, and returns the area it covers. """
 
-            agent_pos = (state['location'][0] * self.env.block_size - agent_offset[0], state['location'][1] * self.env.block_size - agent_offset[1])
+        area = self.pygame.rect.Rect(intersection[0]*self.env.block_size - self.road_width/2 - 2, intersection[1]*self.env.block_size - self.road_width/2 - 2, self.road_width + 5, self.road_width + 5)
+        self.scene.blit(self.background, area, area)
+        self.pygame.draw.circle(self.scene, self.road_color, (intersection[0] * self.env.block_size, intersection[1] * self.env.block_size), self.road_width/2)
+
+        if state: # North-South is open
+            self.scene.blit(self._ns,
+                self.pygame.rect.Rect(intersection[0]*self.env.block_size - self.road_width/2, intersection[1]*self.env.block_size - self.road_width/2, intersection[0]*self.env.block_size + self.road_width, intersection[1]*self.env.block_size + self.road_width/2))
+            self.pygame.draw.line(self.scene, self.stop_color, (intersection[0] * self.env.block_size - self.road_width/2, intersection[1] * self.env.block_size - self.road_width/2), (intersection[0] * self.env.block_size - self.road_width/2, intersection[1] * self.env.block_size + self.road_width/2), 2)
+            self.pygame.draw.line(self.scene, self.stop_color, (intersection[0] * self.env.block_size + self.road_width/2 + 1, intersection[1] * self.env.block_size - self.road_width/2), (intersection[0] * self.env.block_size + self.road_width/2 + 1, intersection[1] * self.env.block_size + self.road_width/2), 2)
+        else:
+            self.scene.blit(self._ew,
+                self.pygame.rect.Rect(intersection[0]*self.env.block_size - self.road_width/2, intersection[1]*self.env.block_size - self.road_width/2, intersection[0]*self.env.block_size + self.road_width, intersection[1]*self.env.block_size + self.road_width/2))
+            self.pygame.draw.line(self.scene, self.stop_color, (intersection[0] * self.env.block_size - self.road_width/2, intersection[1] * self.env.block_size - self.road_width/2), (intersection[0] * self.env.block_size + self.road_width/2, intersection[1] * self.env.block_size - self.road_width/2), 2)
+            self.pygame.draw.line(self.scene, self.stop_color, (intersection[0] * self.env.block_size + self.road_width/2, intersection[1] * self.env.block_size + self.road_width/2 + 1), (intersection[0] * self.env.block_size - self.road_width/2, intersection[1] * self.env.block_size + self.road_width/2 + 1), 2)
+
+        return area
+
+    def agent_rect(self, agent, state):
+        """ Returns the position of 'agent' on screen (back from the intersection some) and the area it covers. """
+
+        agent_offset = (2 * state['heading'][0] * self.agent_circle_radius + self.agent_circle_radius * state['heading'][1] * 0.5, \
+                        2 * state['heading'][1] * self.agent_circle_radius - self.agent_circle_radius * state['heading'][0] * 0.5)
+        agent_pos = (state['location'][0] * self.env.block_size - agent_offset[0], state['location'][1] * self.env.block_size - agent_offset[1])
+
+        if hasattr(agent, '_sprite') and agent._sprite is not None:
+            size = agent._sprite_size
+        else:
+            size = (2 * self.agent_circle_radius, 2 * self.agent_circle_radius)
+        return agent_pos, self.pygame.rect.Rect(agent_pos[0] - size[0] / 2, agent_pos[1] - size[1] / 2, size[0], size[1])
+
+    def draw_agent(self, agent, state, agent_pos):
+        """ Draws 'agent' at 'agent_pos', using its sprite pre-rotated to its heading if it has one. """
+
+        if hasattr(agent, '_sprite') and agent._sprite is not None:
+            # Draw agent sprite (image), properly rotated
+            self.screen.blit(agent._sprites[state['heading']],
+                self.pygame.rect.Rect(agent_pos[0] - agent._sprite_size[0] / 2, agent_pos[1] - agent._sprite_size[1] / 2,
+                    agent._sprite_size[0], agent._sprite_size[1]))
+        else:
+            # Draw simple agent (circle with a short line segment poking out to indicate heading)
             agent_color = self.colors[agent.color]
+            self.pygame.draw.circle(self.screen, agent_color, agent_pos, self.agent_circle_radius)
+            self.pygame.draw.line(self.screen, agent_color, agent_pos, state['location'], self.road_width)
 
-            if hasattr(agent, '_sprite') and agent._sprite is not None:
-                # Draw agent sprite (image), properly rotated
-                rotated_sprite = agent._sprite if state['heading'] == (1, 0) else self.pygame.transform.rotate(agent._sprite, 180 if state['heading'][0] == -1 else state['heading'][1] * -90)
-                self.screen.blit(rotated_sprite,
-                    self.pygame.rect.Rect(agent_pos[0] - agent._sprite_size[0] / 2, agent_pos[1] - agent._sprite_size[1] / 2,
-                        agent._sprite_size[0], agent._sprite_size[1]))
-            else:
-                # Draw simple agent (circle with a short line segment poking out to indicate heading)
-                self.pygame.draw.circle(self.screen, agent_color, agent_pos, self.agent_circle_radius)
-                self.pygame.draw.line(self.screen, agent_color, agent_pos, state['location'], self.road_width)
-            
+    def render(self, trial, testing=False):
+        """ This is the GUI render display of the simulation. 
+            Supplementary trial data can be found from render_text.
+
+            The road network is drawn once to an off-screen scene. Each frame only
+            restores the areas that changed from the scene (traffic lights that
+            switched, agents that moved, the status text), redraws the agents
+            over them and updates those areas of the display. """
+
+        full_redraw = self.scene is None or self.full_redraw
+        if self.scene is None:
+            self.scene = self.build_scene()
+        self.full_redraw = False
+
+        # Areas of the screen to restore from the scene
+        erased = list(self.text_rects)
+
+        # * Static elements: traffic lights that switched since the last frame
+        #   (all of them on the first frame of a scene)
+        lights = self.env.lights
+        switched = lights.changed if self.light_states else xrange(len(lights.states))
+        for i in switched:
+            intersection = self.env.intersection_list[i]
+            state = bool(lights.states[i])
+            if self.light_states.get(intersection) != state:
+                self.light_states[intersection] = state
+                erased.append(self.draw_light(intersection, state))
+        lights.changed.clear()
+
+        # * Dynamic elements
+        agents = []
+        rects = []
+        moved = 0
+        for agent, state in self.env.agent_states.iteritems():
+            agent_pos, rect = self.agent_rect(agent, state)
+            agents.append((agent, state, agent_pos))
+            rects.append(rect)
+            if self.agent_places.get(agent) != (state['location'], state['heading']):
+                # Clear where the agent was, and where it is now
+                if agent in self.agent_rects:
+                    erased.append(self.agent_rects[agent])
+                erased.append(rect)
+                moved += 1
+
+        # Once most agents have moved, one full redraw is cheaper than tracking the areas
+        if 2 * moved > len(agents):
+            full_redraw = True
+
+        destination = self.env.agent_states[self.env.primary_agent]['destination'] if self.env.primary_agent is not None else None
+        logo_rect = None
+        if destination is not None:
+            logo_rect = self.pygame.rect.Rect(destination[0] * self.env.block_size - self.road_width/2, destination[1]*self.env.block_size - self.road_width/2, self.road_width, self.road_width)
+            erased.append(logo_rect)
+        if self.logo_rect is not None:
+            erased.append(self.logo_rect)
+
+        # Every agent overlapping a cleared area is redrawn, which clears its own area in turn
+        redraw = set(range(len(agents))) if full_redraw else set()
+        queue = [] if full_redraw else list(erased)
+        while queue:
+            for i in queue.pop().collidelistall(rects):
+                if i not in redraw:
+                    redraw.add(i)
+                    erased.append(rects[i])
+                    queue.append(rects[i])
+
+        if full_redraw:
+            self.screen.blit(self.scene, (0, 0))
+        else:
+            for rect in erased:
+                self.screen.blit(self.scene, rect, rect)
 
-            if state['destination'] is not None:
-                self.screen.blit(self._logo,
-                    self.pygame.rect.Rect(state['destination'][0] * self.env.block_size - self.road_width/2, \
-                        state['destination'][1]*self.env.block_size - self.road_width/2, \
-                        state['destination'][0]*self.env.block_size + self.road_width/2, \
-                        state['destination'][1]*self.env.block_size + self.road_width/2))
+        # Agents are drawn in the same order as a full redraw, so overlapping sprites stack the same way
+        for i in sorted(redraw):
+            agent, agent_state, agent_pos = agents[i]
+            self.draw_agent(agent, agent_state, agent_pos)
+            self.agent_rects[agent] = rects[i]
+            self.agent_places[agent] = (agent_state['location'], agent_state['heading'])
+
+        self.logo_rect = logo_rect
+        if destination is not None:
+            self.screen.blit(self._logo, logo_rect)
+        dirty = erased
 
         # * Overlays
-        self.font = self.pygame.font.Font(None, 50)
+        text_rects = []
         if testing:
-            self.screen.blit(self.font.render("Testing Trial %s"%(trial), True, self.colors['black'], self.bg_color), (10, 10))
+            text_rects.append(self.screen.blit(self.fonts[50].render("Testing Trial %s"%(trial), True, self.colors['black'], self.bg_color), (10, 10)))
         else:
-            self.screen.blit(self.font.render("Training Trial %s"%(trial), True, self.colors['black'], self.bg_color), (10, 10))
+            text_rects.append(self.screen.blit(self.fonts[50].render("Training Trial %s"%(trial), True, self.colors['black'], self.bg_color), (10, 10)))
 
-        self.font = self.pygame.font.Font(None, 30)
+        font = self.fonts[30]
 
         # Status text about each step
         status = self.env.step_data
@@ -378,86 +715,103 @@ class Simulator(object):
 
             # Previous State
             if status['state']:
-                self.screen.blit(self.font.render("Previous State: {}".format(status['state']), True, self.colors['white'], self.bg_color), (350, 10))
+                text_rects.append(self.screen.blit(font.render("Previous State: {}".format(status['state']), True, self.colors['white'], self.bg_color), (350, 10)))
             if not status['state']:
-                self.screen.blit(self.font.render("!! Agent state not updated!", True, self.colors['maroon'], self.bg_color), (350, 10))
+                text_rects.append(self.screen.blit(font.render("!! Agent state not updated!", True, self.colors['maroon'], self.bg_color), (350, 10)))
 
             # Action
             if status['violation'] == 0: # Legal
                 if status['action'] == None:
-                    self.screen.blit(self.font.render("No action taken. (rewarded {:.2f})".format(status['reward']), True, self.colors['dgreen'], self.bg_color), (350, 40))
+                    text_rects.append(self.screen.blit(font.render("No action taken. (rewarded {:.2f})".format(status['reward']), True, self.colors['dgreen'], self.bg_color), (350, 40)))
                 else:
-                    self.screen.blit(self.font.render("Agent drove {}. (rewarded {:.2f})".format(status['action'], status['reward']), True, self.colors['dgreen'], self.bg_color), (350, 40))
+                    text_rects.append(self.screen.blit(font.render("Agent drove {}. (rewarded {:.2f})".format(status['action'], status['reward']), True, self.colors['dgreen'], self.bg_color), (350, 40)))
             else: # Illegal
                 if status['action'] == None:
-                    self.screen.blit(self.font.render("No action taken. (rewarded {:.2f})".format(status['reward']), True, self.colors['maroon'], self.bg_color), (350, 40))
+                    text_rects.append(self.screen.blit(font.render("No action taken. (rewarded {:.2f})".format(status['reward']), True, self.colors['maroon'], self.bg_color), (350, 40)))
                 else:
-                    self.screen.blit(self.font.render("{} attempted (rewarded {:.2f})".format(status['action'], status['reward']), True, self.colors['maroon'], self.bg_color), (350, 40))
+                    text_rects.append(self.screen.blit(font.render("{} attempted (rewarded {:.2f})".format(status['action'], status['reward']), True, self.colors['maroon'], self.bg_color), (350, 40)))
 
             # Result
             if status['violation'] == 0: # Legal
                 if status['waypoint'] == status['action']: # Followed waypoint
-                    self.screen.blit(self.font.render("Agent followed the waypoint!", True, self.colors['dgreen'], self.bg_color), (350, 70))
+                    text_rects.append(self.screen.blit(font.render("Agent followed the waypoint!", True, self.colors['dgreen'], self.bg_color), (350, 70)))
                 elif status['action'] == None:
                     if status['light'] == 'red': # Stuck at a red light
-                        self.screen.blit(self.font.render("Agent idled at a red light!", True, self.colors['dgreen'], self.bg_color), (350, 70))
+                        text_rects.append(self.screen.blit(font.render("Agent idled at a red light!", True, self.colors['dgreen'], self.bg_color), (350, 70)))
                     else:
-                        self.screen.blit(self.font.render("Agent idled at a green light with oncoming traffic.", True, self.colors['mustard'], self.bg_color), (350, 70))
+                        text_rects.append(self.screen.blit(font.render("Agent idled at a green light with oncoming traffic.", True, self.colors['mustard'], self.bg_color), (350, 70)))
                 else: # Did not follow waypoint
-                    self.screen.blit(self.font.render("Agent did not follow the waypoint.", True, self.colors['mustard'], self.bg_color), (350, 70))
+                    text_rects.append(self.screen.blit(font.render("Agent did not follow the waypoint.", True, self.colors['mustard'], self.bg_color), (350, 70)))
             else: # Illegal
                 if status['violation'] == 1: # Minor violation
-                    self.screen.blit(self.font.render("There was a green light with no oncoming traffic.", True, self.colors['maroon'], self.bg_color), (350, 70))
+                    text_rects.append(self.screen.blit(font.render("There was a green light with no oncoming traffic.", True, self.colors['maroon'], self.bg_color), (350, 70)))
                 elif status['violation'] == 2: # Major violation
-                    self.screen.blit(self.font.render("There was a red light with no traffic.", True, self.colors['maroon'], self.bg_color), (350, 70))
+                    text_rects.append(self.screen.blit(font.render("There was a red light with no traffic.", True, self.colors['maroon'], self.bg_color), (350, 70)))
                 elif status['violation'] == 3: # Minor accident
-                    self.screen.blit(self.font.render("There was traffic with right-of-way.", True, self.colors['maroon'], self.bg_color), (350, 70))
+                    text_rects.append(self.screen.blit(font.render("There was traffic with right-of-way.", True, self.colors['maroon'], self.bg_color), (350, 70)))
                 elif status['violation'] == 4: # Major accident
-                    self.screen.blit(self.font.render("There was a red light with traffic.", True, self.colors['maroon'], self.bg_color), (350, 70))
+                    text_rects.append(self.screen.blit(font.render("There was a red light with traffic.", True, self.colors['maroon'], self.bg_color), (350, 70)))
 
             # Time Remaining
             if self.env.enforce_deadline:
                 time = (status['deadline'] - 1) * 100.0 / (status['t'] + status['deadline'])
-                self.screen.blit(self.font.render("{:.0f}% of time remaining to reach destination.".format(time), True, self.colors['black'], self.bg_color), (350, 100))
+                text_rects.append(self.screen.blit(font.render("{:.0f}% of time remaining to reach destination.".format(time), True, self.colors['black'], self.bg_color), (350, 100)))
             else:
-                self.screen.blit(self.font.render("Agent not enforced to meet deadline.", True, self.colors['black'], self.bg_color), (350, 100))
+                text_rects.append(self.screen.blit(font.render("Agent not enforced to meet deadline.", True, self.colors['black'], self.bg_color), (350, 100)))
             
             # Denote whether a trial was a success or failure
             if (state['destination'] != state['location'] and state['deadline'] > 0) or (self.env.enforce_deadline is not True and state['destination'] != state['location']):
-                self.font = self.pygame.font.Font(None, 40)
                 if self.env.success == True:
-                    self.screen.blit(self.font.render("Previous Trial: Success", True, self.colors['dgreen'], self.bg_color), (10, 50))
+                    text_rects.append(self.screen.blit(self.fonts[40].render("Previous Trial: Success", True, self.colors['dgreen'], self.bg_color), (10, 50)))
                 if self.env.success == False:
-                    self.screen.blit(self.font.render("Previous Trial: Failure", True, self.colors['maroon'], self.bg_color), (10, 50))
+                    text_rects.append(self.screen.blit(self.fonts[40].render("Previous Trial: Failure", True, self.colors['maroon'], self.bg_color), (10, 50)))
 
                 if self.env.primary_agent.learning:
-                    self.font = self.pygame.font.Font(None, 22)
-                    self.screen.blit(self.font.render("epsilon = {:.4f}".format(self.env.primary_agent.epsilon), True, self.colors['black'], self.bg_color), (10, 80))
-                    self.screen.blit(self.font.render("alpha = {:.4f}".format(self.env.primary_agent.alpha), True, self.colors['black'], self.bg_color), (10, 95))
+                    text_rects.append(self.screen.blit(self.fonts[22].render("epsilon = {:.4f}".format(self.env.primary_agent.epsilon), True, self.colors['black'], self.bg_color), (10, 80)))
+                    text_rects.append(self.screen.blit(self.fonts[22].render("alpha = {:.4f}".format(self.env.primary_agent.alpha), True, self.colors['black'], self.bg_color), (10, 95)))
 
         # Reset status text
         else:
-            self.pygame.rect.Rect(350, 10, self.width, 200)
-            self.font = self.pygame.font.Font(None, 40)
-            self.screen.blit(self.font.render("Simulating trial. . .", True, self.colors['white'], self.bg_color), (400, 60))
+            text_rects.append(self.screen.blit(self.fonts[40].render("Simulating trial. . .", True, self.colors['white'], self.bg_color), (400, 60)))
+
+        self.text_rects = text_rects
+        dirty.extend(text_rects)
+
+        # Flip buffers, or only update the areas that changed
+        if full_redraw:
+            self.pygame.display.flip()
+        else:
+            self.pygame.display.update(dirty)
+
+    def capture_frame(self, trial, testing=False):
+        """ Render the current step, off-screen if there is no display, and save it to the capture. """
 
+        self.render(trial, testing)
+        self.capture.save(self.screen)
 
-        # Flip buffers
+    def show_pause_text(self):
+        """ Shows that the simulation or its display is paused, and returns the text shown. """
+
+        self.font = self.fonts[30]
+        if self.fps is None:
+            pause_text = "Simulation Paused. Press any key to continue. . ."
+        else:
+            pause_text = "Display Paused. Press any key to continue. . ."
+        self.screen.blit(self.font.render(pause_text, True, self.colors['red'], self.bg_color), (400, self.height - 30))
         self.pygame.display.flip()
+        print pause_text
+        return pause_text
 
     def pause(self):
         """ When the GUI is enabled, this function will pause the simulation. """
         
         abs_pause_time = time.time()
-        self.font = self.pygame.font.Font(None, 30)
-        pause_text = "Simulation Paused. Press any key to continue. . ."
-        self.screen.blit(self.font.render(pause_text, True, self.colors['red'], self.bg_color), (400, self.height - 30))
-        self.pygame.display.flip()
-        print pause_text
+        pause_text = self.show_pause_text()
         while self.paused:
             for event in self.pygame.event.get():
                 if event.type == self.pygame.KEYDOWN:
                     self.paused = False
             self.pygame.time.wait(self.frame_delay)
         self.screen.blit(self.font.render(pause_text, True, self.bg_color, self.bg_color), (400, self.height - 30))
+        self.full_redraw = True
         self.start_time += (time.time() - abs_pause_time)
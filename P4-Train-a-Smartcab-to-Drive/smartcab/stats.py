@@ -0,0 +1,191 @@
+import ast
+import json
+from collections import deque
+
+# Count of actions in each violation class, indexed by the violation code of Environment.act
+action_columns = ['good_actions', 'minor_violations', 'major_violations', 'minor_accidents', 'major_accidents']
+
+# Rolling columns of visuals.plot_trials: the rolling success rate, and the rolling
+# share of actions in each violation class
+rate_columns = ['good', 'minor', 'major', 'minor_acc', 'major_acc']
+
+# Columns kept for every trial
+stat_columns = ['trial', 'testing', 'epsilon', 'alpha', 'initial_deadline', 'final_deadline', 'net_reward'] + \
+    action_columns + ['success', 'average_reward', 'reliability_rate'] + rate_columns
+
+
+class TrialStats(object):
+    """Online statistics of the trials of a simulation, updated once per trial.
+
+    Keeps the rolling averages that visuals.plot_trials plots (reward per
+    action, success rate and the share of each violation class, over the last
+    'window' trials), along with running totals, so they can be read at any
+    time during training without parsing the metrics log. With keep_columns,
+    every trial is also kept as a row of stat_columns for save(); without it,
+    memory stays constant however many trials are run.
+    """
+
+    def __init__(self, window=10, keep_columns=True):
+        self.window = window
+        self.recent = deque(maxlen=window)  # (reward per action, success, rate of each violation class)
+        self.recent_trials = deque(maxlen=window)  # (steps, action counts, success), for the rolling ratings
+        self.keep_columns = keep_columns
+        self.columns = dict((name, []) for name in stat_columns) if keep_columns else None
+        self.trials = {False: 0, True: 0}    # Trials run, by testing
+        self.successes = {False: 0, True: 0}
+        self.actions = [0] * len(action_columns)
+        self.total_reward = 0.0
+        self.testing_steps = 0
+        self.testing_actions = [0] * len(action_columns)
+
+    def update(self, metrics):
+        """ Add one trial, given as the row written by Simulator.log_metrics. """
+
+        steps = metrics['initial_deadline'] - metrics['final_deadline']
+        counts = [metrics['actions'][violation] for violation in xrange(len(action_columns))]
+        if steps > 0:
+            self.recent.append([metrics['net_reward'] / steps, metrics['success'] * 100.0] + [count * 1.0 / steps for count in counts])
+        else:
+            self.recent.append([float('nan')] * (2 + len(counts)))
+
+        self.recent_trials.append((steps, counts, metrics['success']))
+
+        testing = bool(metrics['testing'])
+        self.trials[testing] += 1
+        self.successes[testing] += metrics['success']
+        for violation, count in enumerate(counts):
+            self.actions[violation] += count
+        self.total_reward += metrics['net_reward']
+        if testing:
+            self.testing_steps += steps
+            for violation, count in enumerate(counts):
+                self.testing_actions[violation] += count
+
+        if not self.keep_columns:
+            return
+        row = {
+            'trial': metrics['trial'],
+            'testing': testing,
+            'epsilon': metrics['parameters']['e'],
+            'alpha': metrics['parameters']['a'],
+            'initial_deadline': metrics['initial_deadline'],
+            'final_deadline': metrics['final_deadline'],
+            'net_reward': metrics['net_reward'],
+            'success': metrics['success']
+        }
+        row.update(zip(action_columns, counts))
+        row.update(zip(['average_reward', 'reliability_rate'] + rate_columns, self.rolling()))
+        for name in stat_columns:
+            self.columns[name].append(row[name])
+
+    def rolling(self):
+        """ Returns the rolling averages over the last 'window' trials, in the order of
+            ['average_reward', 'reliability_rate'] + rate_columns; None until there are enough trials. """
+
+        if len(self.recent) < self.window:
+            return [None] * (2 + len(rate_columns))
+        return [sum(values) / len(values) for values in zip(*self.recent)]
+
+    def summary(self):
+        """ Returns the current statistics as a dictionary. """
+
+        total_actions = sum(self.actions)
+        summary = dict(zip(['average_reward', 'reliability_rate'] + rate_columns, self.rolling()))
+        summary.update({
+            'training_trials': self.trials[False],
+            'testing_trials': self.trials[True],
+            'training_success_rate': self.successes[False] * 1.0 / self.trials[False] if self.trials[False] else None,
+            'testing_success_rate': self.successes[True] * 1.0 / self.trials[True] if self.trials[True] else None,
+            'reward_per_action': self.total_reward / total_actions if total_actions else None,
+            'violation_rates': dict((name, count * 1.0 / total_actions if total_actions else None)
+                                    for name, count in zip(action_columns, self.actions))
+        })
+        summary.update(self.ratings())
+        return summary
+
+    def ratings(self):
+        """ Returns the safety and reliability ratings of visuals.plot_trials, over the testing
+            trials so far and, as an estimate during training, over the last 'window' trials. """
+
+        ratings = {'rolling_safety_rating': None, 'rolling_reliability_rating': None,
+                   'testing_safety_rating': None, 'testing_reliability_rating': None}
+        if self.recent_trials:
+            steps = sum(trial[0] for trial in self.recent_trials)
+            actions = [sum(counts) for counts in zip(*[trial[1] for trial in self.recent_trials])]
+            successes = sum(trial[2] for trial in self.recent_trials)
+            ratings['rolling_safety_rating'] = safety_rating(actions, steps, len(self.recent_trials))
+            ratings['rolling_reliability_rating'] = reliability_rating(successes, len(self.recent_trials))
+        if self.trials[True]:
+            ratings['testing_safety_rating'] = safety_rating(self.testing_actions, self.testing_steps, self.trials[True])
+            ratings['testing_reliability_rating'] = reliability_rating(self.successes[True], self.trials[True])
+        return ratings
+
+    def save(self, filename):
+        """ Write the statistics of every trial, and the current summary, to a JSON file.
+            Requires keep_columns. """
+
+        if not self.keep_columns:
+            raise ValueError("TrialStats(keep_columns=False) does not keep the trials to save.")
+
+        with open(filename, 'w') as f:
+            json.dump({'window': self.window, 'summary': self.summary(), 'columns': self.columns}, f)
+
+
+def safety_rating(actions, steps, trials):
+    """ Returns the safety rating of 'trials' trials of 'steps' steps in total, given the total
+        count of actions in each violation class, in the order of action_columns. """
+
+    good, minor_violations, major_violations, minor_accidents, major_accidents = actions
+    if good * 1.0 / steps == 1: # Perfect driving
+        return "A+"
+    elif major_accidents > 0:
+        return "F"
+    elif minor_accidents > 0:
+        return "D"
+    elif major_violations > 0:
+        return "C"
+    elif minor_violations >= trials / 2: # Minor violation in at least half of the trials
+        return "B"
+    else:
+        return "A"
+
+
+def reliability_rating(successes, trials):
+    """ Returns the reliability rating of 'trials' trials, 'successes' of which reached their destination in time. """
+
+    success_ratio = successes * 1.0 / trials
+    if success_ratio == 1: # Always meets deadline
+        return "A+"
+    elif success_ratio >= 0.90:
+        return "A"
+    elif success_ratio >= 0.80:
+        return "B"
+    elif success_ratio >= 0.70:
+        return "C"
+    elif success_ratio >= 0.60:
+        return "D"
+    else:
+        return "F"
+
+
+def log_row_metrics(row):
+    """ Returns the metrics of a trial, as Simulator passes them to TrialStats.update,
+        from a row of its CSV log read with csv.DictReader. """
+
+    return {
+        'trial': int(row['trial']),
+        'testing': row['testing'] == 'True',
+        'parameters': ast.literal_eval(row['parameters']),
+        'initial_deadline': int(row['initial_deadline']),
+        'final_deadline': int(row['final_deadline']),
+        'net_reward': float(row['net_reward']),
+        'actions': ast.literal_eval(row['actions']),
+        'success': int(row['success'])
+    }
+
+
+def load_stats(filename):
+    """ Returns the per-trial columns saved by TrialStats.save as a dictionary of lists. """
+
+    with open(filename) as f:
+        return json.load(f)['columns']
@@ -0,0 +1,176 @@
+import numpy as np
+from environment import Environment
+
+
+class VectorizedEnvironment(Environment):
+    """Environment that advances all dummy agents in batched NumPy passes.
+
+    Dummy locations, headings and next waypoints are stored as arrays. Sensor
+    inputs for every dummy are resolved at once and legal moves are applied in
+    bulk, so a step costs O(N) rather than O(N^2) in the number of dummies.
+    The primary agent is sensed and scored by the same rules as in Environment.
+
+    Unlike Environment.step, dummies decide their moves simultaneously from the
+    state at the start of the step instead of one after another.
+    """
+
+    # Integer codes used in the arrays: index into valid_actions and valid_headings
+    action_codes = dict((action, i) for i, action in enumerate(Environment.valid_actions))
+    heading_codes = dict((heading, i) for i, heading in enumerate(Environment.valid_headings))
+    NONE, FORWARD, LEFT, RIGHT = 0, 1, 2, 3
+
+    def __init__(self, verbose=False, num_dummies=100, grid_size=(8, 6), sync_states=True, seed=None,
+                 density=None, lane_capacity=1):
+        self.sync_states = sync_states  # If dummy entries of agent_states are updated every step
+        self.dummies = []
+        self.dummy_index = {}
+        self.locations = np.zeros((0, 2), dtype=int)
+        self.headings = np.zeros(0, dtype=int)
+        self.waypoints = np.zeros(0, dtype=int)
+        self.tables = None
+
+        # Dummies are looked up through the batched tables instead of the spatial index
+        super(VectorizedEnvironment, self).__init__(verbose=verbose, num_dummies=num_dummies, grid_size=grid_size, spatial_index=False, seed=seed,
+                                                    density=density, lane_capacity=lane_capacity)
+        self.heading_vectors = np.array(self.valid_headings, dtype=int)
+
+        # NumPy stream for the dummies' new waypoints, seeded from the dummy stream when a seed is given
+        self.np_random = np.random.RandomState(self.dummy_random.getrandbits(32)) if seed is not None else np.random
+
+    def reset(self, testing=False):
+        """ Place agents as Environment.reset does, then load the dummies into arrays. """
+
+        super(VectorizedEnvironment, self).reset(testing)
+
+        dummies = [agent for agent in self.agent_states if agent is not self.primary_agent]
+        if dummies != self.dummies:
+            # First reset, or the dummies changed: take their waypoints from the agents. Otherwise the
+            # waypoints carry over in the array, where they are kept even with sync_states=False
+            self.waypoints = np.array([self.action_codes[agent.next_waypoint] for agent in dummies], dtype=int)
+        self.dummies = dummies
+        self.dummy_index = dict((agent, i) for i, agent in enumerate(self.dummies))
+        states = [self.agent_states[agent] for agent in self.dummies]
+        self.locations = np.array([state['location'] for state in states], dtype=int).reshape(-1, 2)
+        self.headings = np.array([self.heading_codes[state['heading']] for state in states], dtype=int)
+        self.tables = None
+
+    def cells(self, locations):
+        """ Convert an array of (x, y) locations to flat intersection indices. """
+
+        return (locations[..., 0] - self.bounds[0]) * self.grid_size[1] + (locations[..., 1] - self.bounds[1])
+
+    def light_states(self):
+        """ Returns the state of every traffic light, indexed by intersection. """
+
+        return np.frombuffer(self.lights.states, dtype=bool)
+
+    def build_tables(self):
+        """ Summarize the dummies at each (intersection, heading) slot.
+
+            Environment.sense lets some waypoints take priority over others and otherwise
+            keeps the last matching agent, so record per slot: the count of each waypoint,
+            the waypoint of the last dummy, and the first 'forward' or 'left' waypoint. """
+
+        n = len(self.dummies)
+        size = self.grid_size[0] * self.grid_size[1] * len(self.valid_headings)
+        order = np.arange(n)
+        keys = self.cells(self.locations) * len(self.valid_headings) + self.headings
+
+        counts = np.bincount(keys * len(self.valid_actions) + self.waypoints, minlength=size * len(self.valid_actions))
+        last = np.full(size, -1, dtype=int)
+        np.maximum.at(last, keys, order)
+        first = np.full(size, n, dtype=int)
+        turning = (self.waypoints == self.FORWARD) | (self.waypoints == self.LEFT)
+        np.minimum.at(first, keys[turning], order[turning])
+
+        waypoints = np.append(self.waypoints, self.NONE)  # index -1 and n both map to no agent
+        self.tables = {
+            'counts': counts.reshape(size, len(self.valid_actions)),
+            'last': waypoints[np.where(last >= 0, last, n)],
+            'first_turning': waypoints[first]
+        }
+
+    def resolve_inputs(self, cells, headings):
+        """ Resolve the oncoming, left and right inputs for agents at 'cells' facing 'headings'. """
+
+        if self.tables is None:
+            self.build_tables()
+        counts, last, first_turning = self.tables['counts'], self.tables['last'], self.tables['first_turning']
+        slots = cells * len(self.valid_headings)
+
+        # Oncoming traffic: 'left' takes priority, otherwise the last agent wins
+        k = slots + (headings + 2) % 4
+        oncoming = np.where(counts[k, self.LEFT] > 0, self.LEFT, last[k])
+
+        # Traffic from the right: the first 'forward' or 'left' takes priority, then 'right'
+        k = slots + (headings + 1) % 4
+        right = np.where(first_turning[k] != self.NONE, first_turning[k],
+                         np.where(counts[k, self.RIGHT] > 0, self.RIGHT, self.NONE))
+
+        # Traffic from the left: 'forward' takes priority, otherwise the last agent wins
+        k = slots + (headings + 3) % 4
+        left = np.where(counts[k, self.FORWARD] > 0, self.FORWARD, last[k])
+
+        return oncoming, left, right
+
+    def sense(self, agent):
+        """ Sensor inputs for a single agent, looked up from the per-slot tables. """
+
+        assert agent in self.agent_states, "Unknown agent!"
+
+        if agent in self.dummy_index:
+            i = self.dummy_index[agent]
+            location = tuple(self.locations[i].tolist())
+            heading = self.valid_headings[self.headings[i]]
+        else:
+            state = self.agent_states[agent]
+            location = state['location']
+            heading = state['heading']
+        light = 'green' if (self.intersections[location].state and heading[1] != 0) or ((not self.intersections[location].state) and heading[0] != 0) else 'red'
+
+        cell = np.array([self.cells(np.array(location))])
+        oncoming, left, right = self.resolve_inputs(cell, np.array([self.heading_codes[heading]]))
+
+        return {'light': light, 'oncoming': self.valid_actions[oncoming[0]],
+                'left': self.valid_actions[left[0]], 'right': self.valid_actions[right[0]]}
+
+    def update_dummies(self):
+        """ Move every dummy agent under the rules of DummyAgent.update in one batched pass. """
+
+        if not self.dummies:
+            return
+
+        cells = self.cells(self.locations)
+        oncoming, left, right = self.resolve_inputs(cells, self.headings)
+        green = self.light_states()[cells] == (self.headings % 2 == 1)  # True = NS open; odd headings are N, S
+
+        # Check if each chosen waypoint is safe to move to
+        waypoints = self.waypoints
+        okay = np.where(waypoints == self.RIGHT, green | (left != self.FORWARD),
+               np.where(waypoints == self.FORWARD, green,
+                        green & (oncoming != self.FORWARD) & (oncoming != self.RIGHT)))
+
+        # Turn, move with world-wrap, and choose new waypoints for the dummies that moved
+        turns = np.where(waypoints == self.LEFT, 1, np.where(waypoints == self.RIGHT, 3, 0))
+        self.headings = np.where(okay, (self.headings + turns) % 4, self.headings)
+        moved = self.locations[okay] + self.heading_vectors[self.headings[okay]]
+        moved[:, 0] = (moved[:, 0] - self.bounds[0]) % self.grid_size[0] + self.bounds[0]
+        moved[:, 1] = (moved[:, 1] - self.bounds[1]) % self.grid_size[1] + self.bounds[1]
+        self.locations[okay] = moved
+        self.waypoints[okay] = self.np_random.randint(self.FORWARD, len(self.valid_actions), size=len(moved))
+        self.tables = None
+
+        if self.sync_states:
+            self.sync_dummies()
+
+    def sync_dummies(self):
+        """ Copy the dummy arrays back into agent_states and each DummyAgent. """
+
+        locations = self.locations.tolist()
+        headings = self.headings.tolist()
+        waypoints = self.waypoints.tolist()
+        for i, agent in enumerate(self.dummies):
+            state = self.agent_states[agent]
+            state['location'] = tuple(locations[i])
+            state['heading'] = self.valid_headings[headings[i]]
+            agent.next_waypoint = self.valid_actions[waypoints[i]]
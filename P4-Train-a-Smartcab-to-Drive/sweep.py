@@ -0,0 +1,178 @@
+""" Parameter sweeps for the smartcab LearningAgent.
+
+Every combination of agent parameters and random seeds is run as an independent,
+headless simulation on a pool of worker processes. The trial metrics of all runs
+are collected into one table, and each run is graded for safety and reliability
+on its testing trials. Run from the project directory, e.g.
+
+    python sweep.py --alpha 0.01 0.05 0.1 --decay cosine exponential --seeds 0 1 2
+
+With --checkpoint-dir, an interrupted sweep can be restarted with the same command:
+finished runs are loaded from their saved rows, and unfinished runs resume training
+from their last Q-table checkpoint.
+"""
+
+import argparse
+import cPickle as pickle
+import itertools
+import multiprocessing
+import os
+
+import numpy as np
+import pandas as pd
+
+from smartcab.environment import Environment
+from smartcab.agent import LearningAgent
+from smartcab.schedules import schedules, predict_training_trials
+from smartcab.simulator import Simulator
+from smartcab.metrics import action_columns
+import visuals
+
+
+# Agent and simulation parameters that can be swept
+parameter_names = ['epsilon', 'alpha', 'decay', 'tolerance', 'n_test']
+
+
+def expand_grid(grid):
+    """ Returns a list with one dict of parameters per combination of the values in 'grid'. """
+
+    return [dict(zip(parameter_names, values)) for values in itertools.product(*[grid[name] for name in parameter_names])]
+
+
+def job_name(parameters, seed):
+    """ Returns a file name that identifies the run of 'parameters' with 'seed'. """
+
+    return "_".join("{}-{}".format(name, parameters[name]) for name in parameter_names) + "_seed-{}".format(seed)
+
+
+def predicted_trials(parameters):
+    """ Returns the number of training trials predicted for 'parameters', or None if the
+        decay schedule depends on the rewards earned or epsilon never reaches the tolerance. """
+
+    try:
+        return predict_training_trials(parameters['decay'], parameters['epsilon'], parameters['alpha'], parameters['tolerance'])
+    except ValueError:
+        return None
+
+
+def run_job(job):
+    """ Runs a single headless simulation and returns its trial metrics as a list of rows.
+
+        'job' is a (parameters, seed, environment options) tuple. The environment and agent
+        draw from random streams seeded by 'seed', so a job gives the same result on any worker. """
+
+    parameters, seed, options = job
+    checkpoint = None
+    if options['checkpoint_dir'] is not None:
+        prefix = os.path.join(options['checkpoint_dir'], job_name(parameters, seed))
+        checkpoint = prefix + ".pkl"
+        if os.path.exists(prefix + ".rows.pkl"):
+            with open(prefix + ".rows.pkl", 'rb') as f:
+                return pickle.load(f)
+
+    env = Environment(num_dummies=options['num_dummies'], grid_size=options['grid_size'], seed=seed)
+    agent = env.create_agent(LearningAgent, learning=True, epsilon=parameters['epsilon'],
+                             alpha=parameters['alpha'], decay=parameters['decay'])
+    env.set_primary_agent(agent, enforce_deadline=options['enforce_deadline'])
+
+    sim = Simulator(env, fast_forward=True, record_trials=True, checkpoint=checkpoint)
+    sim.run(tolerance=parameters['tolerance'], n_test=parameters['n_test'])
+
+    rows = []
+    for metrics in sim.trial_log:
+        row = dict(parameters, seed=seed)
+        row.update(metrics)
+        # Match the format written by Simulator.log_metrics
+        row['parameters'] = str(metrics['parameters'])
+        row['actions'] = str(metrics['actions'])
+        for violation, name in enumerate(action_columns):
+            row[name] = metrics['actions'][violation]
+        rows.append(row)
+
+    if checkpoint is not None:
+        with open(prefix + ".rows.pkl", 'wb') as f:
+            pickle.dump(rows, f, pickle.HIGHEST_PROTOCOL)
+    return rows
+
+
+def summarize(trials):
+    """ Returns one row per run with its trial counts, testing success rate and grades. """
+
+    summary = []
+    for key, run in trials.groupby(parameter_names + ['seed'], sort=False):
+        row = dict(zip(parameter_names + ['seed'], key))
+        training = run[run['testing'] == False]
+        testing = run[run['testing'] == True]
+        row['training_trials'] = len(training)
+        row['predicted_training_trials'] = predicted_trials(row)
+        row['testing_trials'] = len(testing)
+        row['success_rate'] = testing['success'].mean() if len(testing) > 0 else np.nan
+        row['safety'] = visuals.calculate_safety(testing)[0] if len(testing) > 0 else None
+        row['reliability'] = visuals.calculate_reliability(testing)[0] if len(testing) > 0 else None
+        summary.append(row)
+
+    columns = parameter_names + ['seed', 'training_trials', 'predicted_training_trials', 'testing_trials', 'success_rate', 'safety', 'reliability']
+    return pd.DataFrame(summary, columns=columns)
+
+
+def run_sweep(grid, seeds, processes=None, num_dummies=100, grid_size=(8, 6), enforce_deadline=True, checkpoint_dir=None):
+    """ Runs every combination of 'grid' parameters for every seed across a process pool.
+
+        Returns a (trials, summary) pair of DataFrames: the metrics of every trial of
+        every run, and one row per run with its safety and reliability grades.
+        With 'checkpoint_dir', each run saves its progress there and picks it up when rerun. """
+
+    if checkpoint_dir is not None and not os.path.isdir(checkpoint_dir):
+        os.makedirs(checkpoint_dir)
+    options = {'num_dummies': num_dummies, 'grid_size': grid_size, 'enforce_deadline': enforce_deadline,
+               'checkpoint_dir': checkpoint_dir}
+    jobs = [(parameters, seed, options) for parameters in expand_grid(grid) for seed in seeds]
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(run_job, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    columns = parameter_names + ['seed', 'trial', 'testing', 'parameters', 'initial_deadline',
+                                 'final_deadline', 'net_reward', 'actions'] + action_columns + ['success']
+    trials = pd.DataFrame([row for rows in results for row in rows], columns=columns)
+    return trials, summarize(trials)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep LearningAgent parameters over a pool of headless simulations.")
+    parser.add_argument('--epsilon', type=float, nargs='+', default=[1.0])
+    parser.add_argument('--alpha', type=float, nargs='+', default=[0.5])
+    parser.add_argument('--decay', nargs='+', default=['cosine'], choices=sorted(schedules))
+    parser.add_argument('--tolerance', type=float, nargs='+', default=[0.05])
+    parser.add_argument('--n-test', type=int, nargs='+', default=[10])
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0])
+    parser.add_argument('--processes', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--num-dummies', type=int, default=100)
+    parser.add_argument('--grid-size', type=int, nargs=2, default=[8, 6])
+    parser.add_argument('--checkpoint-dir', default=None, help="directory to save run progress to, to restart the sweep")
+    parser.add_argument('--output', default=os.path.join("logs", "sweep"), help="prefix of the result files")
+    args = parser.parse_args()
+
+    grid = {'epsilon': args.epsilon, 'alpha': args.alpha, 'decay': args.decay,
+            'tolerance': args.tolerance, 'n_test': args.n_test}
+
+    # Size the sweep before running it
+    predicted = [predicted_trials(parameters) for parameters in expand_grid(grid)]
+    known = [trials for trials in predicted if trials is not None]
+    print "{} runs; {} training trials predicted for {} of {} parameter combinations".format(
+        len(predicted) * len(args.seeds), sum(known) * len(args.seeds), len(known), len(predicted))
+
+    trials, summary = run_sweep(grid, args.seeds, processes=args.processes,
+                                num_dummies=args.num_dummies, grid_size=tuple(args.grid_size),
+                                checkpoint_dir=args.checkpoint_dir)
+
+    trials.to_csv(args.output + "_trials.csv", index=False)
+    summary.to_csv(args.output + "_results.csv", index=False)
+    print summary.to_string(index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,8 +6,10 @@ warnings.filterwarnings("ignore", category = UserWarning, module = "matplotlib")
 ###########################################
 #
 # Display inline matplotlib plots with IPython
+# (skipped when imported outside of IPython, e.g. by sweep.py)
 from IPython import get_ipython
-get_ipython().run_line_magic('matplotlib', 'inline')
+if get_ipython() is not None:
+	get_ipython().run_line_magic('matplotlib', 'inline')
 ###########################################
 
 import matplotlib.pyplot as plt
@@ -15,77 +17,80 @@ import numpy as np
 import pandas as pd
 import os
 import ast
+from smartcab import metrics, stats
+
+
+# Plot color of each rating
+rating_colors = {"A+": "green", "A": "green", "B": "green", "C": "#EEC700", "D": "#EEC700", "F": "red"}
 
 
 def calculate_safety(data):
 	""" Calculates the safety rating of the smartcab during testing. """
 
-	good_ratio = data['good_actions'].sum() * 1.0 / \
-	(data['initial_deadline'] - data['final_deadline']).sum()
-
-	if good_ratio == 1: # Perfect driving
-		return ("A+", "green")
-	else: # Imperfect driving
-		if data['actions'].apply(lambda x: ast.literal_eval(x)[4]).sum() > 0: # Major accident
-			return ("F", "red")
-		elif data['actions'].apply(lambda x: ast.literal_eval(x)[3]).sum() > 0: # Minor accident
-			return ("D", "#EEC700")
-		elif data['actions'].apply(lambda x: ast.literal_eval(x)[2]).sum() > 0: # Major violation
-			return ("C", "#EEC700")
-		else: # Minor violation
-			minor = data['actions'].apply(lambda x: ast.literal_eval(x)[1]).sum()
-			if minor >= len(data)/2: # Minor violation in at least half of the trials
-				return ("B", "green")
-			else:
-				return ("A", "green")
+	rating = stats.safety_rating([data[name].sum() for name in stats.action_columns],
+		(data['initial_deadline'] - data['final_deadline']).sum(), len(data))
+	return (rating, rating_colors[rating])
 
 
 def calculate_reliability(data):
 	""" Calculates the reliability rating of the smartcab during testing. """
 
-	success_ratio = data['success'].sum() * 1.0 / len(data)
+	rating = stats.reliability_rating(data['success'].sum(), len(data))
+	return (rating, rating_colors[rating])
 
-	if success_ratio == 1: # Always meets deadline
-		return ("A+", "green")
-	else:
-		if success_ratio >= 0.90:
-			return ("A", "green")
-		elif success_ratio >= 0.80:
-			return ("B", "green")
-		elif success_ratio >= 0.70:
-			return ("C", "#EEC700")
-		elif success_ratio >= 0.60:
-			return ("D", "#EEC700")
-		else:
-			return ("F", "red")
 
+def load_trials(filename):
+	""" Loads logged trial metrics, with one column per violation class and for epsilon and alpha.
+		A .npz log is read as it is; the dictionaries of a .csv log are parsed once per row.
+		A _stats.json file saved by the Simulator also holds the rolling averages plotted. """
 
-def plot_trials(csv):
-	""" Plots the data from logged metrics during a simulation."""
+	if filename.endswith(".json"):
+		return pd.DataFrame(stats.load_stats(filename), columns=stats.stat_columns).fillna(value=np.nan)
 
-	data = pd.read_csv(os.path.join("logs", csv))
+	if filename.endswith(".npz"):
+		return pd.DataFrame(metrics.load_trials(filename), columns=[name for name, dtype in metrics.trial_columns])
+
+	data = pd.read_csv(filename)
+	actions = data['actions'].apply(ast.literal_eval)
+	for violation, name in enumerate(metrics.action_columns):
+		data[name] = actions.apply(lambda x: x[violation])
+	parameters = data['parameters'].apply(ast.literal_eval)
+	data['epsilon'] = parameters.apply(lambda x: x['e'])
+	data['alpha'] = parameters.apply(lambda x: x['a'])
+	return data
+
+
+def add_rolling_features(data):
+	""" Adds the 10-trial rolling averages plotted by plot_trials to 'data'. """
 
-	if len(data) < 10:
-		print "Not enough data collected to create a visualization."
-		print "At least 20 trials are required."
-		return
-	
-	# Create additional features
 	data['average_reward'] = (data['net_reward'] / (data['initial_deadline'] - data['final_deadline'])).rolling(window=10, center=False).mean()
 	data['reliability_rate'] = (data['success']*100).rolling(window=10, center=False).mean()  # compute avg. net reward with window=10
-	data['good_actions'] = data['actions'].apply(lambda x: ast.literal_eval(x)[0])
 	data['good'] = (data['good_actions'] * 1.0 / \
 		(data['initial_deadline'] - data['final_deadline'])).rolling(window=10, center=False).mean()
-	data['minor'] = (data['actions'].apply(lambda x: ast.literal_eval(x)[1]) * 1.0 / \
+	data['minor'] = (data['minor_violations'] * 1.0 / \
 		(data['initial_deadline'] - data['final_deadline'])).rolling(window=10, center=False).mean()
-	data['major'] = (data['actions'].apply(lambda x: ast.literal_eval(x)[2]) * 1.0 / \
+	data['major'] = (data['major_violations'] * 1.0 / \
 		(data['initial_deadline'] - data['final_deadline'])).rolling(window=10, center=False).mean()
-	data['minor_acc'] = (data['actions'].apply(lambda x: ast.literal_eval(x)[3]) * 1.0 / \
+	data['minor_acc'] = (data['minor_accidents'] * 1.0 / \
 		(data['initial_deadline'] - data['final_deadline'])).rolling(window=10, center=False).mean()
-	data['major_acc'] = (data['actions'].apply(lambda x: ast.literal_eval(x)[4]) * 1.0 / \
+	data['major_acc'] = (data['major_accidents'] * 1.0 / \
 		(data['initial_deadline'] - data['final_deadline'])).rolling(window=10, center=False).mean()
-	data['epsilon'] = data['parameters'].apply(lambda x: ast.literal_eval(x)['e']) 
-	data['alpha'] = data['parameters'].apply(lambda x: ast.literal_eval(x)['a']) 
+
+
+def plot_trials(csv):
+	""" Plots the data from logged metrics during a simulation.
+		'csv' is the name of a .csv or .npz log, or of a _stats.json file, in the logs folder. """
+
+	data = load_trials(os.path.join("logs", csv))
+
+	if len(data) < 10:
+		print "Not enough data collected to create a visualization."
+		print "At least 20 trials are required."
+		return
+	
+	# Create additional features, unless they were computed during the simulation
+	if 'average_reward' not in data:
+		add_rolling_features(data)
 
 
 	# Create training and testing subsets
@@ -119,7 +124,7 @@ def plot_trials(csv):
 	ax = plt.subplot2grid((6,6), (2,3), colspan=3, rowspan=2)
 
 	# Check whether the agent was expected to learn
-	if csv != 'sim_no-learning.csv':
+	if not csv.startswith('sim_no-learning'):
 		ax.set_ylabel("Parameter Value")
 		ax.set_xlabel("Trial Number")
 		ax.set_xlim((1, len(training_data)))